@@ -0,0 +1,165 @@
+"""
+Answer Cache Module for APS Naturals Chatbot
+A small thread-safe LRU cache with a time-to-live, used to serve repeated
+questions without re-running answer generation, and a table of precomputed
+answers for the questions the chatbot suggests itself (suggestion buttons,
+conversation starters, FAQ).
+"""
+
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+
+class AnswerCache:
+    """Bounded LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, max_size=1024, ttl=3600.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.source = None  # Knowledge base the cached answers came from
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bind(self, source):
+        """Drop all entries if answers now come from a different knowledge base"""
+        if source is not self.source:
+            with self._lock:
+                if source is not self.source:
+                    if self.source is not None:
+                        self.invalidations += 1
+                    self._entries.clear()
+                    self.source = source
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entry when full"""
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counters for the /health endpoint"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
+
+
+def load_questions(path):
+    """Questions of a FAQ file: one per line, blank lines and # comments skipped"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+class AnswerTable:
+    """
+    Precomputed answers of a fixed set of questions (conversation starters,
+    suggestion buttons, FAQ), one table per knowledge base snapshot
+    Tables are built with one generate_answers_batch() call, normally right
+    after a snapshot is loaded (prepare), so asking one of these questions is
+    a single dict lookup
+    """
+
+    def __init__(self, questions=(), key=str):
+        self.key = key  # Normal form used to match questions, e.g. normalize_query
+        self.questions = list(dict.fromkeys(questions))
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.last_build_seconds = None
+        self._tables = weakref.WeakKeyDictionary()  # knowledge base -> {key: (answer, confidence)}
+        self._lock = threading.Lock()
+        self._counter_lock = threading.Lock()  # Not _lock, which is held for whole table builds
+
+    def prepare(self, kb, clean=None):
+        """
+        Build the table of a knowledge base snapshot (if not built yet)
+        Questions that clean to nothing are left out: they never reach answer
+        generation
+        """
+        table = self._tables.get(kb)
+        if table is not None:
+            return table
+
+        with self._lock:
+            table = self._tables.get(kb)
+            if table is None:
+                start = time.perf_counter()
+                questions = [q for q in self.questions if clean is None or clean(q)]
+                answers = kb.generate_answers_batch(questions) if questions else []
+                table = {self.key(q): answer for q, answer in zip(questions, answers)}
+                self._tables[kb] = table
+                self.builds += 1
+                self.last_build_seconds = time.perf_counter() - start
+        return table
+
+    def get(self, kb, key):
+        """(answer, confidence) of a known question, or None"""
+        table = self._tables.get(kb)
+        answer = table.get(key) if table is not None else None
+        with self._counter_lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def stats(self):
+        """Counters for the /health endpoint"""
+        with self._counter_lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'questions': len(self.questions),
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'builds': self.builds,
+            'last_build_seconds': self.last_build_seconds
+        }
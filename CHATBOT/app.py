@@ -3,29 +3,182 @@ APS Naturals Chatbot - Web Interface
 Knowledge-based chatbot that dynamically generates answers
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
+import concurrent.futures
+import functools
 import os
 import random
-from knowledge_base import get_knowledge_base
-from preprocessing import clean_text
+import threading
+import time
+from kb_reloader import KnowledgeBaseReloader
+from kb_registry import KnowledgeBaseRegistry
+from knowledge_base import KnowledgeBase
+from sharded_kb import ShardedKnowledgeBase
+from retrievers import BM25Retriever, DenseRetriever, FusedRetriever, MLPRetriever, SectionRetriever
+from preprocessing import clean_text, normalize_query
+from query_intent import classifier
+from answer_cache import AnswerCache, AnswerTable, load_questions
+from single_flight import BoundedExecutor, Overloaded, SingleFlight
+from metrics import REGISTRY, CONFIDENCE_BUCKETS, Stopwatch, profiler
 
 app = Flask(__name__)
 
-# Load knowledge base
-print("="*60)
-print("🚀 APS Naturals Chatbot - Web Server")
-print("="*60)
-
-try:
-    print("\n📚 Loading knowledge base...")
-    kb = get_knowledge_base()
-    kb_loaded = True
-    print(f"✅ Knowledge base loaded successfully!")
-    print(f"   - {len(kb.all_sentences)} information pieces")
-    print(f"   - {len(kb.sections)} categories")
-except Exception as e:
-    print(f"❌ Error loading knowledge base: {e}")
-    kb_loaded = False
+# Repeated questions (suggestion buttons, starters) are served from this cache
+answer_cache = AnswerCache(
+    max_size=int(os.environ.get('ANSWER_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('ANSWER_CACHE_TTL', 3600))
+)
+
+# Answers are computed on CHAT_WORKERS threads, at most CHAT_MAX_PENDING
+# distinct questions at a time (more get a 503); identical questions asked
+# while one is being answered wait for that answer instead of recomputing it
+answer_flight = SingleFlight(BoundedExecutor(
+    max_workers=int(os.environ.get('CHAT_WORKERS', 1)),
+    max_pending=int(os.environ.get('CHAT_MAX_PENDING', 64))
+))
+CHAT_TIMEOUT = float(os.environ.get('CHAT_TIMEOUT', 10))
+CHAT_STATUS = {'overloaded': 503, 'unknown_tenant': 404}
+
+CHAT_REQUESTS = REGISTRY.counter(
+    'chatbot_chat_requests_total', '/chat requests by outcome', ['outcome'])
+CHAT_SECONDS = REGISTRY.histogram(
+    'chatbot_chat_request_seconds', 'Time to handle a /chat request')
+ANSWER_CONFIDENCE = REGISTRY.histogram(
+    'chatbot_answer_confidence', 'Confidence of answered questions', buckets=CONFIDENCE_BUCKETS)
+
+def _fallback_ratio():
+    answered = CHAT_REQUESTS.labels('answered').value
+    fallback = CHAT_REQUESTS.labels('fallback').value
+    return fallback / (answered + fallback) if answered + fallback else 0.0
+
+REGISTRY.callback('chatbot_fallback_ratio',
+                  'Share of questions that got the fallback reply', _fallback_ratio)
+REGISTRY.callback('chatbot_answer_cache_hits_total', 'Answer cache hits',
+                  lambda: answer_cache.hits, kind='counter')
+REGISTRY.callback('chatbot_answer_cache_misses_total', 'Answer cache misses',
+                  lambda: answer_cache.misses, kind='counter')
+REGISTRY.callback('chatbot_answer_cache_evictions_total', 'Answer cache evictions',
+                  lambda: answer_cache.evictions, kind='counter')
+REGISTRY.callback('chatbot_chat_coalesced_total', 'Questions that shared an answer already being computed',
+                  lambda: answer_flight.shared, kind='counter')
+REGISTRY.callback('chatbot_chat_in_flight', 'Distinct questions being answered',
+                  lambda: answer_flight.in_flight)
+REGISTRY.callback('chatbot_answer_table_hits_total', 'Questions answered from the precomputed table',
+                  lambda: answer_table.hits, kind='counter')
+
+# Set CHATBOT_PROFILE=1 to sample stacks from startup (see /admin/profile)
+if os.environ.get('CHATBOT_PROFILE') == '1':
+    profiler.start()
+
+# The knowledge base is loaded on first use rather than at import time, and
+# rebuilt in the background when the knowledge file changes.
+# KB_SHARDS=N (N > 1) scores every question on N worker processes in parallel;
+# KB_RETRIEVER picks the scorer (see retrievers.py): unset for TF-IDF cosine,
+# bm25, dense (matches by meaning with LSA vectors), hybrid (bm25 + dense),
+# mlp (the trained classifier exported to qa_model.npz, see mlp_model.py) or
+# sections (TF-IDF cosine on the KB_SECTION_NPROBE best [SECTION]s only)
+kb_shards = int(os.environ.get('KB_SHARDS', 1))
+kb_factory = functools.partial(ShardedKnowledgeBase, shards=kb_shards) if kb_shards > 1 else KnowledgeBase
+# KB_VECTOR_DTYPE=float32 or int8 stores the sentence vectors in less memory
+# (see knowledge_base.VECTOR_DTYPES for the score tolerance)
+if os.environ.get('KB_VECTOR_DTYPE', 'float64') != 'float64':
+    kb_factory = functools.partial(kb_factory, vector_dtype=os.environ['KB_VECTOR_DTYPE'])
+# KB_DEDUPE_THRESHOLD=0.8 keeps one sentence per group of near-duplicates
+# (word overlap of at least 80%, see near_duplicates.py)
+if os.environ.get('KB_DEDUPE_THRESHOLD'):
+    kb_factory = functools.partial(kb_factory, dedupe_threshold=float(os.environ['KB_DEDUPE_THRESHOLD']))
+# KB_SPELLING=1 corrects misspelled question words to knowledge base terms
+# ("organik" -> "organic") before searching (see spelling.py)
+if os.environ.get('KB_SPELLING') == '1':
+    kb_factory = functools.partial(kb_factory, spelling=True)
+dense_retriever = functools.partial(DenseRetriever, nprobe=int(os.environ.get('KB_DENSE_NPROBE', 8)))
+RETRIEVERS = {
+    'bm25': BM25Retriever,
+    'dense': dense_retriever,
+    'hybrid': functools.partial(FusedRetriever, retrievers=(BM25Retriever, dense_retriever)),
+    'mlp': MLPRetriever,
+    'sections': functools.partial(SectionRetriever,
+                                  nprobe=int(os.environ.get('KB_SECTION_NPROBE', 3)),
+                                  flat_ratio=float(os.environ.get('KB_SECTION_FLAT_RATIO', 0.8)))
+}
+if os.environ.get('KB_RETRIEVER') in RETRIEVERS:
+    kb_factory = functools.partial(kb_factory, retriever=RETRIEVERS[os.environ['KB_RETRIEVER']])
+
+def build_knowledge_base(knowledge_file):
+    """Load a knowledge base snapshot and precompute its answer table before it is served"""
+    kb = kb_factory(knowledge_file)
+    answer_table.prepare(kb, clean_text)
+    return kb
+
+kb_reloader = KnowledgeBaseReloader(
+    os.environ.get('KNOWLEDGE_FILE', "dataset/apsnaturals_qa_dataset.txt"),
+    poll_interval=float(os.environ.get('KB_WATCH_INTERVAL', 2)),
+    factory=build_knowledge_base
+)
+kb_loaded = False
+_kb_attempted = False
+_kb_lock = threading.Lock()
+
+# Multi-tenant mode: with KB_TENANTS_DIR set, a /chat request naming a tenant
+# (a "tenant" field or an X-Tenant header) is answered from
+# KB_TENANTS_DIR/<tenant>.txt, loaded on first use; the least recently used
+# tenants are unloaded when all loaded ones exceed KB_MEMORY_BUDGET_MB.
+# Requests without a tenant use the default knowledge base above.
+kb_registry = KnowledgeBaseRegistry(
+    os.environ['KB_TENANTS_DIR'],
+    factory=build_knowledge_base,
+    memory_budget=int(float(os.environ.get('KB_MEMORY_BUDGET_MB', 512)) * (1 << 20)),
+    answer_cache_factory=lambda: AnswerCache(
+        max_size=int(os.environ.get('TENANT_ANSWER_CACHE_SIZE', 128)),
+        ttl=float(os.environ.get('ANSWER_CACHE_TTL', 3600))
+    ),
+    poll_interval=float(os.environ.get('KB_WATCH_INTERVAL', 2))
+) if os.environ.get('KB_TENANTS_DIR') else None
+
+if kb_registry is not None:
+    REGISTRY.callback('chatbot_tenants_loaded', 'Tenant knowledge bases in memory',
+                      lambda: kb_registry.loaded_count)
+    REGISTRY.callback('chatbot_tenants_resident_bytes', 'Estimated memory of the loaded tenant knowledge bases',
+                      kb_registry.resident_bytes)
+    REGISTRY.callback('chatbot_tenant_evictions_total', 'Tenant knowledge bases unloaded to fit the memory budget',
+                      lambda: kb_registry.evictions, kind='counter')
+
+def load_knowledge_base(watch=True):
+    """
+    Current knowledge base snapshot, loading it on first use
+    Returns None if the initial load failed. With watch=False the file watcher
+    is not started (a pre-fork master starts it in each worker instead).
+    """
+    global kb_loaded, _kb_attempted
+    if _kb_attempted:
+        return kb_reloader.current
+    
+    with _kb_lock:
+        if _kb_attempted:
+            return kb_reloader.current
+        
+        print("="*60)
+        print("🚀 APS Naturals Chatbot - Web Server")
+        print("="*60)
+        
+        try:
+            print("\n📚 Loading knowledge base...")
+            kb = kb_reloader.load()
+            if watch:
+                kb_reloader.start_watching()
+            kb_loaded = True
+            print(f"✅ Knowledge base loaded successfully!")
+            print(f"   - {len(kb.all_sentences)} information pieces")
+            print(f"   - {len(kb.sections)} categories")
+            if kb.compaction:
+                print(f"   - {kb.compaction['sentences'] - kb.compaction['kept']} near-duplicates folded "
+                      f"(compaction ratio {kb.compaction['ratio']:.2f}x)")
+        except Exception as e:
+            print(f"❌ Error loading knowledge base: {e}")
+            kb_loaded = False
+        
+        _kb_attempted = True
+        return kb_reloader.current
 
 # Predefined conversation starters and follow-up suggestions
 CONVERSATION_STARTERS = [
@@ -67,22 +220,18 @@ TOPIC_SUGGESTIONS = {
     ]
 }
 
+# Every question the chatbot suggests itself, plus the questions of FAQ_FILE
+# (one per line), is answered once per knowledge base snapshot
+answer_table = AnswerTable(
+    CONVERSATION_STARTERS
+    + [q for questions in TOPIC_SUGGESTIONS.values() for q in questions]
+    + (load_questions(os.environ['FAQ_FILE']) if os.environ.get('FAQ_FILE') else []),
+    key=normalize_query
+)
+
 def get_topic_from_query(query):
     """Identify the topic of a query"""
-    query_lower = query.lower()
-    
-    if any(word in query_lower for word in ["product", "offer", "type", "sell", "have"]):
-        return "products"
-    elif any(word in query_lower for word in ["quality", "safe", "chemical", "test", "cruelty"]):
-        return "quality"
-    elif any(word in query_lower for word in ["eco", "environment", "sustain", "green", "nature"]):
-        return "sustainability"
-    elif any(word in query_lower for word in ["use", "who", "age", "skin", "daily", "apply"]):
-        return "usage"
-    elif any(word in query_lower for word in ["mission", "value", "company", "brand", "different", "about"]):
-        return "company"
-    else:
-        return "company"
+    return classifier.classify(query).topic
 
 def get_follow_up_suggestions(user_query):
     """Generate relevant follow-up questions"""
@@ -107,72 +256,223 @@ def home():
 
 @app.route('/chat', methods=['POST'])
 def chat():
-    if not kb_loaded:
-        return jsonify({
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        payload, outcome = _chat(Stopwatch())
+        return jsonify(payload), CHAT_STATUS.get(outcome, 200)
+    finally:
+        CHAT_REQUESTS.labels(outcome).inc()
+        CHAT_SECONDS.observe(time.perf_counter() - start)
+
+def answer_question(kb, cache, user_message, cache_key):
+    """Generate an answer and cache it (runs on an answer_flight worker thread)"""
+    answer = kb.generate_answer(user_message)
+    cache.put(cache_key, answer)
+    return answer
+
+def requested_tenant():
+    """
+    Tenant named by the request (JSON "tenant" field or X-Tenant header), or None
+    A "tenant" field that is not a string is returned as is (and rejected)
+    """
+    body = request.get_json(silent=True)
+    tenant = body.get('tenant') if isinstance(body, dict) else None
+    if tenant is None or tenant == '':
+        tenant = request.headers.get('X-Tenant') or None
+    return tenant
+
+def _chat(watch):
+    """Answer a /chat request; returns the response payload and its outcome label"""
+    tenant_name = requested_tenant()
+    if tenant_name is None:
+        kb, cache = load_knowledge_base(), answer_cache
+    else:
+        try:
+            if kb_registry is None or not isinstance(tenant_name, str):
+                raise KeyError(tenant_name)
+            kb, tenant = kb_registry.get(tenant_name)
+            cache = tenant.answer_cache
+        except KeyError:
+            return {
+                'response': f"❌ Unknown tenant: {tenant_name}",
+                'suggestions': [],
+                'error': True
+            }, 'unknown_tenant'
+        except RuntimeError as e:
+            print(f"❌ Error loading knowledge base of tenant {tenant_name!r}: {e}")
+            kb = None
+    if kb is None:
+        return {
             'response': "❌ Knowledge base is not loaded. Please check the server logs.",
             'suggestions': [],
             'error': True
-        })
+        }, 'kb_unavailable'
+    watch.lap('app_load_kb')
     
     try:
         user_message = request.json.get('message', '').strip()
+        watch.lap('app_parse_request')
         
         if not user_message:
-            return jsonify({
+            return {
                 'response': "Please ask me a question about APS Naturals.",
                 'suggestions': random.sample(CONVERSATION_STARTERS, 4)
-            })
+            }, 'empty'
         
-        # Clean input
-        cleaned_input = clean_text(user_message)
+        # Suggested questions are precomputed; other repeated questions are
+        # served from the cache (cleared if the KB changes)
+        cache_key = normalize_query(user_message)
+        cached = answer_table.get(kb, cache_key)
+        if cached is None:
+            cache.bind(kb)
+            cached = cache.get(cache_key)
+        watch.lap('app_cache_lookup')
         
-        if not cleaned_input:
-            return jsonify({
-                'response': "I didn't quite understand that. Could you rephrase your question?",
-                'suggestions': get_follow_up_suggestions(user_message)
-            })
+        if cached is None:
+            # Clean input
+            cleaned_input = clean_text(user_message)
+            watch.lap('app_clean_text')
+            
+            if not cleaned_input:
+                return {
+                    'response': "I didn't quite understand that. Could you rephrase your question?",
+                    'suggestions': get_follow_up_suggestions(user_message)
+                }, 'not_understood'
+            
+            # Generate answer from knowledge base, once for identical concurrent questions
+            try:
+                cached = answer_flight.do((kb, cache_key), answer_question, kb, cache, user_message, cache_key,
+                                          timeout=CHAT_TIMEOUT)
+            except (Overloaded, concurrent.futures.TimeoutError):
+                return {
+                    'response': "I'm answering a lot of questions right now. Please try again in a moment.",
+                    'suggestions': [],
+                    'error': True
+                }, 'overloaded'
+            watch.lap('app_generate_answer')
         
-        # Generate answer from knowledge base
-        answer, confidence = kb.generate_answer(user_message)
+        answer, confidence = cached
         
-        if answer and confidence > 0.12:
+        if answer and confidence > kb.thresholds.answer:
             response = answer
             suggestions = get_follow_up_suggestions(user_message)
+            outcome = 'answered'
+            ANSWER_CONFIDENCE.observe(confidence)
         else:
             response = ("I don't have specific information about that. "
                        "I can answer questions about APS Naturals products, "
                        "quality standards, sustainability practices, and company values.")
             suggestions = random.sample(CONVERSATION_STARTERS, 4)
+            outcome = 'fallback'
+        watch.lap('app_suggestions')
         
-        return jsonify({
+        return {
             'response': response,
             'suggestions': suggestions,
             'confidence': float(confidence) if confidence else 0.0
-        })
+        }, outcome
     
     except Exception as e:
         print(f"Error in chat endpoint: {e}")
-        return jsonify({
+        return {
             'response': "An error occurred while processing your question. Please try again.",
             'suggestions': random.sample(CONVERSATION_STARTERS, 4),
             'error': True
-        })
+        }, 'error'
 
 @app.route('/initial-suggestions', methods=['GET'])
 def initial_suggestions():
     """Provide initial conversation starters"""
     return jsonify({'suggestions': random.sample(CONVERSATION_STARTERS, 4)})
 
+def is_admin_request():
+    """
+    Admin endpoints require the X-Admin-Token header when ADMIN_TOKEN is set,
+    otherwise they only accept local requests
+    """
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    if admin_token:
+        return request.headers.get('X-Admin-Token') == admin_token
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    """
+    Rebuild the knowledge base in the background and swap it in
+    Pass ?wait=1 to return after the swap.
+    """
+    if not is_admin_request():
+        return jsonify({'error': 'forbidden'}), 403
+    
+    if load_knowledge_base() is None:
+        return jsonify({'error': 'knowledge base is not loaded'}), 503
+    
+    wait = request.args.get('wait') in ('1', 'true')
+    started = kb_reloader.reload(wait=wait)
+    return jsonify({
+        'status': 'reloaded' if wait else ('reloading' if started else 'already_reloading'),
+        'kb_reload': kb_reloader.stats()
+    })
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """
+    Sampling profiler toggle: POST ?action=start|stop, GET returns the
+    collected stacks in folded format (feed to flamegraph.pl / speedscope)
+    """
+    if not is_admin_request():
+        return jsonify({'error': 'forbidden'}), 403
+    
+    if request.method == 'GET':
+        return Response(profiler.collapsed(), mimetype='text/plain')
+    
+    action = request.args.get('action', 'start')
+    if action == 'start':
+        changed = profiler.start()
+    elif action == 'stop':
+        changed = profiler.stop()
+    else:
+        return jsonify({'error': f'unknown action {action!r}'}), 400
+    return jsonify({'running': profiler.running, 'changed': changed,
+                    'stacks': len(profiler.samples)})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: stage latencies, request outcomes, confidence, cache"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
+    kb = load_knowledge_base()
     return jsonify({
         'status': 'healthy',
         'kb_loaded': kb_loaded,
-        'knowledge_pieces': len(kb.all_sentences) if kb_loaded else 0
+        'knowledge_pieces': len(kb.all_sentences) if kb_loaded else 0,
+        'compaction': kb.compaction if kb_loaded else None,
+        'spelling': kb.speller.stats() if kb_loaded and kb.speller is not None else None,
+        'answer_cache': answer_cache.stats(),
+        'answer_table': answer_table.stats(),
+        'single_flight': answer_flight.stats(),
+        'kb_reload': kb_reloader.stats(),
+        'sharding': kb.stats() if isinstance(kb, ShardedKnowledgeBase) else None,
+        'sections': kb.retriever.stats() if isinstance(getattr(kb, 'retriever', None), SectionRetriever) else None,
+        'tenants': kb_registry.stats() if kb_registry is not None else None
     })
 
+@app.route('/admin/tenants', methods=['GET'])
+def admin_tenants():
+    """Per-tenant load time, hit rate, resident size and answer cache counters"""
+    if not is_admin_request():
+        return jsonify({'error': 'forbidden'}), 403
+    
+    if kb_registry is None:
+        return jsonify({'error': 'multi-tenant mode is off (set KB_TENANTS_DIR)'}), 404
+    return jsonify({'registry': kb_registry.stats(), 'tenants': kb_registry.tenant_stats()})
+
 if __name__ == '__main__':
+    load_knowledge_base()
     print("\n" + "="*60)
     if kb_loaded:
         print("✅ Server ready!")
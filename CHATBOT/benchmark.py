@@ -0,0 +1,845 @@
+"""
+APS Naturals Chatbot - Benchmarks
+Measures the cost of the chatbot's hot paths and prints the results as JSON,
+so runs can be saved and compared between releases.
+
+Usage:
+    python benchmark.py normalizer [--texts 20000] [--repeat 5]
+    python benchmark.py imports [--modules app chatbot knowledge_base] [--repeat 5]
+    python benchmark.py http [--url http://127.0.0.1:5000] [--concurrency 1 2 4 8] [--duration 10]
+    python benchmark.py synth --sentences 100000 --out dataset/synthetic.txt
+    python benchmark.py pipeline [--sentences 1000 10000 100000] [--concurrency 8]
+    python benchmark.py loader [--sentences 10000 100000]
+    python benchmark.py vectors [--sentences 100000 500000]
+    python benchmark.py shards [--sentences 200000] [--shards 1 2 4]
+    python benchmark.py retrievers [--sentences 20000] [--nprobe 1 2 4 8 16]
+    python benchmark.py scorers [--sentences 20000]
+    python benchmark.py sections [--sentences 50000] [--nprobe 1 2 4 8]
+    python benchmark.py spelling [--typos 1] [--sentences 20000]
+
+Add --output FILE before the command to also save the JSON.
+"""
+
+import argparse
+import ast
+import functools
+import http.client
+import json
+import os
+import pickle
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _best_of(func, repeat):
+    """Best wall-clock time of several runs, in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _sample_queries(count, seed=0):
+    """User-like questions built from the knowledge base vocabulary"""
+    rng = random.Random(seed)
+    openers = ["What is", "Are your", "Tell me about", "How do you", "Can I use", "Why do you"]
+    words = ["APS", "Naturals", "products", "organic", "eco-friendly", "sensitive", "skin",
+             "quality", "sustainability", "chemicals", "ingredients", "values", "mission",
+             "the", "and", "for", "daily", "use", "cruelty-free", "safe", "brand"]
+    return [f"{rng.choice(openers)} {' '.join(rng.choices(words, k=rng.randint(2, 8)))}?"
+            for _ in range(count)]
+
+
+SYNTH_BRANDS = ["APS Naturals", "The brand", "Our company"]
+SYNTH_VERBS = ["offers", "uses", "provides", "develops", "ensures", "supports", "promotes",
+               "avoids", "recommends", "ships", "tests", "sources"]
+SYNTH_WORDS = ["natural", "organic", "herbal", "products", "ingredients", "skin", "hair",
+               "sensitive", "daily", "care", "eco-friendly", "sustainable", "quality", "safety",
+               "wellness", "health", "chemical-free", "cruelty-free", "packaging", "customers",
+               "formulations", "oils", "extracts", "soap", "shampoo", "cream", "lotion", "tea",
+               "ethical", "environment", "standards", "purity", "values", "mission", "support"]
+
+
+def generate_knowledge_file(path, sentences, per_section=50, seed=0, section_terms=0):
+    """
+    Write a synthetic knowledge file in the [SECTION] format
+    Sentences mix the shipped vocabulary with catalog-style product terms,
+    so the vocabulary keeps growing with the file like a real catalog's
+    With section_terms > 0 each section draws its product terms from its own
+    pool of that many, so sections are about different things
+    """
+    rng = random.Random(seed)
+    catalog_terms = max(100, sentences // 10)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("# SYNTHETIC KNOWLEDGE BASE (generated by benchmark.py)\n")
+        for i in range(sentences):
+            if i % per_section == 0:
+                f.write(f"\n[SECTION_{i // per_section:06d}]\n")
+            words = rng.choices(SYNTH_WORDS, k=rng.randint(3, 10))
+            if section_terms:
+                section = i // per_section
+                words += [f"item{section}x{rng.randrange(section_terms)}" for _ in range(rng.randint(1, 3))]
+            else:
+                words += [f"item{rng.randrange(catalog_terms)}" for _ in range(rng.randint(1, 3))]
+            rng.shuffle(words)
+            f.write(f"{rng.choice(SYNTH_BRANDS)} {rng.choice(SYNTH_VERBS)} {' '.join(words)}.\n")
+    return path
+
+
+def _percentiles(samples, points=(50, 95, 99)):
+    """Nearest-rank percentiles of a list of samples"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {f'p{p}': None for p in points}
+    return {f'p{p}': ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+
+
+def bench_normalizer(args):
+    """Per-call cost of clean_text against the original implementation"""
+    from preprocessing import clean_text, normalizer, stop_words
+
+    def legacy_clean_text(text):
+        text = text.lower()
+        text = text.translate(str.maketrans('', '', string.punctuation))
+        tokens = text.split()
+        tokens = [word for word in tokens if word not in stop_words]
+        return " ".join(tokens)
+
+    texts = _sample_queries(args.texts)
+    expected = [legacy_clean_text(text) for text in texts]
+    if [clean_text(text) for text in texts] != expected or list(normalizer.clean_many(texts)) != expected:
+        raise AssertionError("normalizer output differs from the original clean_text")
+
+    timings = {
+        'legacy_clean_text': _best_of(lambda: [legacy_clean_text(t) for t in texts], args.repeat),
+        'clean_text': _best_of(lambda: [clean_text(t) for t in texts], args.repeat),
+        'clean_many': _best_of(lambda: list(normalizer.clean_many(texts)), args.repeat)
+    }
+    per_call_us = {name: seconds / len(texts) * 1e6 for name, seconds in timings.items()}
+    return {
+        'texts': len(texts),
+        'per_call_us': per_call_us,
+        'speedup_vs_legacy': {name: per_call_us['legacy_clean_text'] / us
+                              for name, us in per_call_us.items() if name != 'legacy_clean_text'}
+    }
+
+
+def _import_time(module):
+    """
+    Import cost of a module in a fresh interpreter, from python -X importtime
+    Returns the module's cumulative time and its direct imports, in microseconds
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=HERE, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{proc.stderr}")
+
+    # Lines look like "import time:   self |   cumulative | <indent>name"; a
+    # module is printed after everything it imported, two spaces deeper
+    children = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if depth == 1:
+            children[name] = int(cumulative)
+        elif depth == 0:
+            if name == module:
+                return int(cumulative), children
+            children = {}
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def bench_imports(args):
+    """Cold import cost of the entry-point modules (best of several fresh interpreters)"""
+    modules = {}
+    for module in args.modules:
+        runs = [_import_time(module) for _ in range(args.repeat)]
+        total_us, children = min(runs, key=lambda run: run[0])
+        heaviest = sorted(children.items(), key=lambda item: -item[1])[:args.top]
+        modules[module] = {
+            'cumulative_ms': total_us / 1000,
+            'heaviest_imports_ms': {name: us / 1000 for name, us in heaviest}
+        }
+    return {'repeat': args.repeat, 'modules': modules}
+
+
+def _drive_chat(url, queries, concurrency, duration):
+    """Keep `concurrency` keep-alive clients posting to /chat for `duration` seconds"""
+    target = urllib.parse.urlsplit(url)
+    path = target.path.rstrip('/') + '/chat'
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    deadline = time.perf_counter() + duration
+
+    def client(worker):
+        conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+        n = worker
+        while time.perf_counter() < deadline:
+            body = json.dumps({'message': queries[n % len(queries)]})
+            n += concurrency
+            start = time.perf_counter()
+            try:
+                conn.request('POST', path, body, {'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+            if ok:
+                latencies[worker].append((time.perf_counter() - start) * 1000)
+            else:
+                errors[worker] += 1
+        conn.close()
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    samples = [ms for per_client in latencies for ms in per_client]
+    result = {
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'errors': sum(errors),
+        'throughput_rps': len(samples) / elapsed
+    }
+    result.update({f'{name}_ms': ms for name, ms in _percentiles(samples).items()})
+    return result
+
+
+def bench_http(args):
+    """Load test of a running server's /chat endpoint at increasing concurrency"""
+    queries = [args.question] if args.question else _sample_queries(args.queries, seed=args.seed)
+    runs = [_drive_chat(args.url, queries, concurrency, args.duration)
+            for concurrency in args.concurrency]
+    return {'url': args.url, 'duration_seconds': args.duration, 'distinct_queries': len(set(queries)),
+            'runs': runs}
+
+
+def _latencies_us(func, queries):
+    """Per-call latency of func over the queries, in microseconds"""
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+def _latency_summary(samples):
+    summary = {f'{name}_us': us for name, us in _percentiles(samples).items()}
+    summary['mean_us'] = sum(samples) / len(samples) if samples else None
+    return summary
+
+
+def _serve_knowledge_base(app_module, kb, cache):
+    """Point the Flask app at an already built knowledge base"""
+    app_module.kb_reloader.current = kb
+    app_module.kb_loaded = True
+    app_module._kb_attempted = True
+    app_module.answer_cache.clear()
+    if not cache:
+        app_module.answer_cache.max_size = 0
+
+
+def _drive_test_client(app_module, queries, concurrency, requests_per_client):
+    """Post to /chat through Flask test clients from `concurrency` threads"""
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+
+    def client(worker):
+        test_client = app_module.app.test_client()
+        for n in range(requests_per_client):
+            query = queries[(worker + n * concurrency) % len(queries)]
+            start = time.perf_counter()
+            response = test_client.post('/chat', json={'message': query})
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if response.status_code == 200 and not response.json.get('error'):
+                latencies[worker].append(elapsed_ms)
+            else:
+                errors[worker] += 1
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    samples = [ms for per_client in latencies for ms in per_client]
+    result = {'concurrency': concurrency, 'requests': len(samples), 'errors': sum(errors),
+              'throughput_rps': len(samples) / elapsed}
+    result.update({f'{name}_ms': ms for name, ms in _percentiles(samples).items()})
+    return result
+
+
+def bench_pipeline(args):
+    """Build time, query latency, memory and /chat throughput on synthetic knowledge bases"""
+    import app as app_module
+    from knowledge_base import KnowledgeBase
+
+    queries = _sample_queries(args.queries, seed=args.seed)
+
+    # Pay the one-off scikit-learn import before anything is timed
+    KnowledgeBase(os.path.join(HERE, "dataset", "apsnaturals_qa_dataset.txt"), use_index=False).search("warm up")
+
+    sizes = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in args.sentences:
+            path = generate_knowledge_file(os.path.join(tmp, f"kb_{count}.txt"), count, seed=args.seed)
+
+            # Build time without tracing overhead, then memory with tracemalloc
+            start = time.perf_counter()
+            kb = KnowledgeBase(path, use_index=False)
+            build_seconds = time.perf_counter() - start
+            del kb
+
+            tracemalloc.start()
+            kb = KnowledgeBase(path, use_index=False)
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            result = {
+                'sentences': len(kb.all_sentences),
+                'file_mb': os.path.getsize(path) / 2**20,
+                'vocabulary': len(kb.vectorizer.vocabulary_),
+                'build_seconds': build_seconds,
+                'memory_mb': {'retained': retained / 2**20, 'build_peak': peak / 2**20},
+                'search': _latency_summary(_latencies_us(kb.search, queries)),
+                'generate_answer': _latency_summary(_latencies_us(kb.generate_answer, queries))
+            }
+
+            _serve_knowledge_base(app_module, kb, args.cache)
+            result['chat'] = _drive_test_client(app_module, queries, args.concurrency,
+                                                args.requests // args.concurrency)
+            sizes.append(result)
+            del kb
+
+    return {'queries': len(queries), 'answer_cache': args.cache, 'sizes': sizes}
+
+
+def bench_loader(args):
+    """Build time and peak memory of the in-memory and the streaming knowledge file loaders"""
+    import numpy as np
+    from knowledge_base import KnowledgeBase
+
+    # Pay the one-off scikit-learn import before anything is measured
+    KnowledgeBase(os.path.join(HERE, "dataset", "apsnaturals_qa_dataset.txt"), use_index=False).search("warm up")
+
+    sizes = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in args.sentences:
+            path = generate_knowledge_file(os.path.join(tmp, f"kb_{count}.txt"), count, seed=args.seed)
+            result = {'sentences': count, 'file_mb': os.path.getsize(path) / 2**20}
+
+            vectors = {}
+            for name, streaming in (('in_memory', False), ('streaming', True)):
+                start = time.perf_counter()
+                kb = KnowledgeBase(path, use_index=False, streaming=streaming)
+                build_seconds = time.perf_counter() - start
+                del kb
+
+                tracemalloc.start()
+                kb = KnowledgeBase(path, use_index=False, streaming=streaming)
+                retained, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                matrix = kb.sentence_vectors
+                vectors[name] = matrix
+                result[name] = {
+                    'build_seconds': build_seconds,
+                    'retained_mb': retained / 2**20,
+                    'build_peak_mb': peak / 2**20,
+                    'vectors_mb': (matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes) / 2**20
+                }
+                del kb
+
+            a, b = vectors['in_memory'], vectors['streaming']
+            result['identical'] = all(np.array_equal(getattr(a, part), getattr(b, part))
+                                      for part in ('indptr', 'indices', 'data'))
+            sizes.append(result)
+
+    return {'sizes': sizes}
+
+
+def bench_vectors(args):
+    """Memory, latency and accuracy of float64 / float32 / int8 sentence vectors"""
+    import numpy as np
+    from knowledge_base import KnowledgeBase, VECTOR_DTYPES
+
+    queries = _sample_queries(args.queries, seed=args.seed)
+    sizes = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in args.sentences:
+            path = generate_knowledge_file(os.path.join(tmp, f"kb_{count}.txt"), count, seed=args.seed)
+            result = {'sentences': count}
+            reference = reference_ranked = None
+            for dtype in VECTOR_DTYPES:
+                kb = KnowledgeBase(path, use_index=False, vector_dtype=dtype)
+                matrix = kb.sentence_vectors
+                vector_bytes = matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+                if kb.row_scales is not None:
+                    vector_bytes += kb.row_scales.nbytes
+
+                ranked = [kb.rank_tfidf(q, 5) for q in queries]
+                row = {
+                    'vectors_mb': vector_bytes / 2**20,
+                    'search': _latency_summary(_latencies_us(lambda q: kb.rank_tfidf(q, 5), queries)),
+                    'batch_seconds': _best_of(lambda: kb.rank_tfidf_batch(queries, 5), args.repeat)
+                }
+                if reference is None:
+                    reference, reference_ranked = kb, ranked
+                else:
+                    # Score error against float64 on the float64 top 5
+                    errors = [np.abs(kb.similarities(kb.vectorizer.transform([q]), ids) - scores).max()
+                              for q, (ids, scores) in zip(queries, reference_ranked) if len(ids)]
+                    row['max_score_error'] = float(max(errors, default=0.0))
+                    row['top5_identical'] = sum(np.array_equal(a[0], b[0])
+                                                for a, b in zip(ranked, reference_ranked)) / len(queries)
+                    row['top5_overlap'] = sum(len(set(a[0].tolist()) & set(b[0].tolist())) / len(b[0])
+                                              if len(b[0]) else 1.0
+                                              for a, b in zip(ranked, reference_ranked)) / len(queries)
+                    # Swaps only among near-ties: every sentence picked scores, in float64,
+                    # within twice the score error of the float64 5th best
+                    row['top5_within_tolerance'] = sum(
+                        len(a[0]) == len(b[0]) and (len(a[0]) == 0 or reference.similarities(
+                            reference.vectorizer.transform([q]), a[0]).min() >= b[1][-1] - 2 * row['max_score_error'])
+                        for q, a, b in zip(queries, ranked, reference_ranked)) / len(queries)
+                result[dtype] = row
+                del kb
+            del reference
+            sizes.append(result)
+
+    return {'queries': len(queries), 'sizes': sizes}
+
+
+def bench_shards(args):
+    """Search latency of the sharded knowledge base by number of shards"""
+    from knowledge_base import KnowledgeBase
+    from sharded_kb import ShardedKnowledgeBase
+
+    queries = _sample_queries(args.queries, seed=args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = generate_knowledge_file(os.path.join(tmp, "kb.txt"), args.sentences, seed=args.seed)
+        kb = KnowledgeBase(path, use_index=False)
+        expected = [kb.search(query) for query in queries]
+        result = {'sentences': args.sentences, 'queries': len(queries), 'cpu_count': os.cpu_count(),
+                  'unsharded': _latency_summary(_latencies_us(kb.search, queries))}
+
+        runs = []
+        for count in args.shards:
+            sharded = ShardedKnowledgeBase(path, use_index=False, shards=count)
+            # Starts the worker processes; also checks the results match
+            identical = [sharded.search(query) for query in queries] == expected
+            runs.append({'shards': len(sharded.shards), 'identical': identical,
+                         'search': _latency_summary(_latencies_us(sharded.search, queries))})
+            sharded.close()
+
+    result['sharded'] = runs
+    return result
+
+
+def _demo_questions():
+    """The test_questions list of demo.py, read without running the demo"""
+    with open(os.path.join(HERE, "demo.py"), 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], 'id', None) == 'test_questions':
+            return ast.literal_eval(node.value)
+    raise ValueError("test_questions not found in demo.py")
+
+
+def bench_retrievers(args):
+    """Lexical TF-IDF vs dense LSA + IVF retrieval: hit rate, latency and ANN recall"""
+    from knowledge_base import KnowledgeBase
+    from retrievers import DenseRetriever
+
+    # Demo questions on the shipped knowledge base
+    path = os.path.join(HERE, "dataset", "apsnaturals_qa_dataset.txt")
+    questions = _demo_questions()
+    engines = {
+        'lexical': KnowledgeBase(path, use_index=False),
+        'dense': KnowledgeBase(path, use_index=False,
+                               retriever=functools.partial(DenseRetriever, use_index=False))
+    }
+    top_sentences = {name: [[r['text'] for r in kb.search(q)][:1] for q in questions]
+                     for name, kb in engines.items()}
+
+    demo = {'questions': len(questions)}
+    for name, kb in engines.items():
+        answers = [kb.generate_answer(q) for q in questions]
+        answered = [confidence for answer, confidence in answers if answer is not None]
+        demo[name] = {
+            'hit_rate': len(answered) / len(questions),
+            'mean_confidence': sum(answered) / len(answered) if answered else None,
+            'search': _latency_summary(_latencies_us(kb.search, questions * 20))
+        }
+    demo['dense']['top1_agrees_with_lexical'] = sum(
+        a == b for a, b in zip(top_sentences['lexical'], top_sentences['dense'])) / len(questions)
+
+    # Recall/latency trade-off of the IVF index on a synthetic knowledge base
+    queries = _sample_queries(args.queries, seed=args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = generate_knowledge_file(os.path.join(tmp, "kb.txt"), args.sentences, seed=args.seed)
+        lexical = KnowledgeBase(path, use_index=False)
+        start = time.perf_counter()
+        dense = KnowledgeBase(path, use_index=False, retriever=DenseRetriever)
+        build_seconds = time.perf_counter() - start
+        retriever = dense.retriever
+        n_lists = len(retriever.centroids)
+
+        exact = [set(retriever.search(q, 5, nprobe=n_lists)[0].tolist()) for q in queries]
+        sweep = []
+        for nprobe in sorted(set(min(n, n_lists) for n in args.nprobe + [n_lists])):
+            found = [set(retriever.search(q, 5, nprobe=nprobe)[0].tolist()) for q in queries]
+            recall = sum(len(f & e) for f, e in zip(found, exact)) / max(1, sum(len(e) for e in exact))
+            latencies = _latencies_us(lambda q: retriever.search(q, 5, nprobe=nprobe), queries)
+            sweep.append({'nprobe': nprobe, 'recall_at_5': recall, 'search': _latency_summary(latencies)})
+
+        synthetic = {
+            'sentences': args.sentences,
+            'queries': len(queries),
+            'n_lists': n_lists,
+            'dimensions': retriever.vectors.shape[1],
+            'dense_build_seconds': build_seconds,
+            'lexical_search': _latency_summary(_latencies_us(lexical.search, queries)),
+            'dense_nprobe': sweep
+        }
+
+    return {'demo': demo, 'synthetic': synthetic}
+
+
+def bench_sections(args):
+    """Flat vs two-stage (section centroid) TF-IDF search: recall, fallback rate and latency"""
+    from knowledge_base import KnowledgeBase
+    from retrievers import SectionRetriever
+
+    def compare(path, questions, nprobes):
+        flat = KnowledgeBase(path, use_index=False)
+        exact = [set(flat.search(q).ids.tolist()) for q in questions]
+        report = {'flat_search': _latency_summary(_latencies_us(flat.search, questions)), 'nprobe': []}
+        for nprobe in nprobes:
+            kb = KnowledgeBase(path, use_index=False, retriever=functools.partial(
+                SectionRetriever, nprobe=nprobe, flat_ratio=args.flat_ratio))
+            found = [set(kb.search(q).ids.tolist()) for q in questions]
+            recall = sum(len(f & e) for f, e in zip(found, exact)) / max(1, sum(len(e) for e in exact))
+            kb.retriever.searches = kb.retriever.fallbacks = 0
+            latencies = _latencies_us(kb.search, questions)
+            report['nprobe'].append({'nprobe': nprobe, 'recall_at_5': recall,
+                                     'fallback_rate': kb.retriever.stats()['fallback_rate'],
+                                     'search': _latency_summary(latencies)})
+        report['sections'] = len(kb.retriever.section_names)
+        return report
+
+    demo = compare(os.path.join(HERE, "dataset", "apsnaturals_qa_dataset.txt"), _demo_questions(), [1, 2, 3])
+
+    # Catalog-like knowledge base whose sections have their own product terms;
+    # questions are half of the words of random sentences
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = generate_knowledge_file(os.path.join(tmp, "kb.txt"), args.sentences,
+                                       per_section=args.per_section, seed=args.seed, section_terms=2)
+        with open(path, 'r', encoding='utf-8') as f:
+            sentences = [line.strip() for line in f if line.strip() and line[0] not in '#[']
+        questions = [' '.join(rng.sample(words, max(2, len(words) // 2)))
+                     for words in (s.split() for s in rng.sample(sentences, args.queries))]
+        synthetic = compare(path, questions, args.nprobe)
+        synthetic['sentences'] = args.sentences
+
+    return {'flat_ratio': args.flat_ratio, 'demo': demo, 'synthetic': synthetic}
+
+
+OFF_TOPIC_QUESTIONS = [
+    "What is the weather today?", "Do you sell cars?", "Who won the football game?",
+    "How do I reset my router?", "Can you book a flight?", "What's your favourite movie?",
+    "Tell me a joke", "How much is bitcoin?", "Do you offer gift cards?", "Where is your store located?"
+]
+
+
+def _labelled_questions():
+    """(cleaned question, expected sentence) pairs from the old training data"""
+    with open(os.path.join(HERE, "questions_original.pkl"), 'rb') as f:
+        questions = pickle.load(f)
+    with open(os.path.join(HERE, "answers.pkl"), 'rb') as f:
+        answers = pickle.load(f)
+    # The old answers prefix some knowledge base sentences with "Yes, "
+    return [(q, a[len("Yes, "):] if a.startswith("Yes, ") else a) for q, a in zip(questions, answers)]
+
+
+def bench_scorers(args):
+    """TF-IDF cosine vs BM25 vs hybrid scoring: answer quality, fallback rate and latency"""
+    from knowledge_base import KnowledgeBase
+    from retrievers import BM25Retriever, DenseRetriever, FusedRetriever
+
+    dense = functools.partial(DenseRetriever, use_index=False)
+    scorers = {
+        'tfidf_cosine': None,
+        'bm25': BM25Retriever,
+        'dense': dense,
+        'hybrid_bm25_dense': functools.partial(FusedRetriever, retrievers=(BM25Retriever, dense))
+    }
+    labelled = _labelled_questions()
+    samples = _sample_queries(args.queries, seed=args.seed)
+
+    def fallback_rate(kb, questions):
+        return sum(kb.generate_answer(q)[0] is None for q in questions) / len(questions)
+
+    # Shipped knowledge base: quality on the old training questions, fallback rates
+    path = os.path.join(HERE, "dataset", "apsnaturals_qa_dataset.txt")
+    shipped = {'labelled_questions': len(labelled)}
+    for name, retriever in scorers.items():
+        kb = KnowledgeBase(path, use_index=False, retriever=retriever)
+        reciprocal_ranks = []
+        for question, expected in labelled:
+            texts = [r['text'] for r in kb.search(question, 5)]
+            reciprocal_ranks.append(1.0 / (texts.index(expected) + 1) if expected in texts else 0.0)
+        shipped[name] = {
+            'thresholds': kb.thresholds._asdict(),
+            'hit_at_1': sum(rr == 1.0 for rr in reciprocal_ranks) / len(labelled),
+            'mrr_at_5': sum(reciprocal_ranks) / len(labelled),
+            'fallback_rate': {'sample_questions': fallback_rate(kb, samples),
+                              'off_topic': fallback_rate(kb, OFF_TOPIC_QUESTIONS)},
+            'search': _latency_summary(_latencies_us(kb.search, samples))
+        }
+
+    # Synthetic knowledge base: cost per query at a larger size
+    synthetic = {'sentences': args.sentences}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = generate_knowledge_file(os.path.join(tmp, "kb.txt"), args.sentences, seed=args.seed)
+        for name, retriever in scorers.items():
+            start = time.perf_counter()
+            kb = KnowledgeBase(path, use_index=False, retriever=retriever)
+            synthetic[name] = {'build_seconds': time.perf_counter() - start,
+                               'fallback_rate': fallback_rate(kb, samples),
+                               'search': _latency_summary(_latencies_us(kb.search, samples))}
+
+    return {'queries': len(samples), 'shipped': shipped, 'synthetic': synthetic}
+
+
+def misspell(question, rng, typos=1):
+    """question with a typo (deletion, substitution, insertion or swap) in `typos` of its long words"""
+    words = question.split()
+    long_words = [i for i, word in enumerate(words) if len(word.strip(string.punctuation)) >= 5]
+    for i in rng.sample(long_words, min(typos, len(long_words))):
+        word = words[i]
+        pos = rng.randrange(1, len(word.rstrip(string.punctuation)) - 1)
+        edit = rng.randrange(4)
+        if edit == 0:
+            word = word[:pos] + word[pos + 1:]
+        elif edit == 1:
+            word = word[:pos] + rng.choice(string.ascii_lowercase) + word[pos + 1:]
+        elif edit == 2:
+            word = word[:pos] + rng.choice(string.ascii_lowercase) + word[pos:]
+        else:
+            word = word[:pos] + word[pos + 1] + word[pos] + word[pos + 2:]
+        words[i] = word
+    return ' '.join(words)
+
+
+def bench_spelling(args):
+    """Fallback rate on misspelled questions with and without spelling correction, and its cost"""
+    from knowledge_base import KnowledgeBase
+
+    rng = random.Random(args.seed)
+    questions = _demo_questions() + _sample_queries(args.queries, seed=args.seed)
+    misspelled = [misspell(question, rng, args.typos) for question in questions]
+
+    def fallback_rate(kb, questions):
+        return sum(kb.generate_answer(q)[0] is None for q in questions) / len(questions)
+
+    def top_sentences(kb, questions):
+        return [tuple(kb.search(q, 1).ids) for q in questions]
+
+    def correction_latency(kb, queries):
+        kb.speller.correct_word.cache_clear()
+        cold = _latencies_us(kb.speller.correct, queries)
+        return {'first_seen': _latency_summary(cold),
+                'repeated': _latency_summary(_latencies_us(kb.speller.correct, queries))}
+
+    path = os.path.join(HERE, "dataset", "apsnaturals_qa_dataset.txt")
+    plain = KnowledgeBase(path, use_index=False)
+    start = time.perf_counter()
+    corrected = KnowledgeBase(path, use_index=False, spelling=True)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    corrected.build_speller()
+    speller_seconds = time.perf_counter() - start
+
+    expected = top_sentences(plain, questions)
+    # One-keyword questions fall back as soon as the keyword is misspelled
+    keywords = [f"Tell me about {term}" for term in sorted(plain.vectorizer.vocabulary_) if len(term) >= 5]
+    misspelled_keywords = [misspell(question, rng) for question in keywords]
+    shipped = {
+        'questions': len(questions),
+        'typos_per_question': args.typos,
+        'load_seconds': load_seconds,
+        'speller_build_seconds': speller_seconds,
+        'fallback_rate': {
+            'clean': fallback_rate(plain, questions),
+            'clean_corrected': fallback_rate(corrected, questions),
+            'misspelled': fallback_rate(plain, misspelled),
+            'misspelled_corrected': fallback_rate(corrected, misspelled),
+            'keyword': fallback_rate(plain, keywords),
+            'keyword_misspelled': fallback_rate(plain, misspelled_keywords),
+            'keyword_misspelled_corrected': fallback_rate(corrected, misspelled_keywords),
+            'off_topic': fallback_rate(plain, OFF_TOPIC_QUESTIONS),
+            'off_topic_corrected': fallback_rate(corrected, OFF_TOPIC_QUESTIONS)
+        },
+        # Misspelled questions whose best sentence is the clean question's
+        'top1_recovered': {
+            'uncorrected': sum(a == b for a, b in zip(top_sentences(plain, misspelled), expected)) / len(questions),
+            'corrected': sum(a == b for a, b in zip(top_sentences(corrected, misspelled), expected)) / len(questions)
+        },
+        'clean_results_unchanged': top_sentences(corrected, questions) == expected,
+        'correction': correction_latency(corrected, misspelled),
+        'correction_clean': _latency_summary(_latencies_us(corrected.speller.correct, questions)),
+        'search': {'uncorrected': _latency_summary(_latencies_us(plain.search, misspelled)),
+                   'corrected': _latency_summary(_latencies_us(corrected.search, misspelled))},
+        'speller': corrected.speller.stats()
+    }
+
+    # Larger vocabulary: the deletion index and lookups stay small (targets are max_features terms)
+    synthetic = {'sentences': args.sentences}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = generate_knowledge_file(os.path.join(tmp, "kb.txt"), args.sentences, seed=args.seed)
+        kb = KnowledgeBase(path, use_index=False, spelling=True)
+        start = time.perf_counter()
+        kb.build_speller()
+        synthetic['speller_build_seconds'] = time.perf_counter() - start
+        synthetic['correction'] = correction_latency(kb, misspelled)
+        synthetic['speller'] = kb.speller.stats()
+
+    return {'shipped': shipped, 'synthetic': synthetic}
+
+
+def bench_synth(args):
+    """Write a synthetic knowledge file"""
+    generate_knowledge_file(args.out, args.sentences, args.per_section, args.seed)
+    return {'path': args.out, 'sentences': args.sentences,
+            'file_mb': os.path.getsize(args.out) / 2**20}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="APS Naturals chatbot benchmarks")
+    parser.add_argument('--output', help="also write the JSON result to this file")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    normalizer = commands.add_parser('normalizer', help="clean_text micro-benchmark")
+    normalizer.add_argument('--texts', type=int, default=20000)
+    normalizer.add_argument('--repeat', type=int, default=5)
+    normalizer.set_defaults(func=bench_normalizer)
+
+    imports = commands.add_parser('imports', help="python -X importtime startup cost")
+    imports.add_argument('--modules', nargs='+', default=['app', 'chatbot', 'knowledge_base'])
+    imports.add_argument('--repeat', type=int, default=5)
+    imports.add_argument('--top', type=int, default=5, help="direct imports to list per module")
+    imports.set_defaults(func=bench_imports)
+
+    load = commands.add_parser('http', help="/chat load test against a running server")
+    load.add_argument('--url', default="http://127.0.0.1:5000")
+    load.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8])
+    load.add_argument('--duration', type=float, default=10.0, help="seconds per concurrency level")
+    load.add_argument('--queries', type=int, default=5000, help="questions cycled through")
+    load.add_argument('--seed', type=int, default=0)
+    load.add_argument('--question', help="send only this question (burst of identical requests)")
+    load.set_defaults(func=bench_http)
+
+    synth = commands.add_parser('synth', help="write a synthetic [SECTION] knowledge file")
+    synth.add_argument('--sentences', type=int, default=10000)
+    synth.add_argument('--per-section', type=int, default=50)
+    synth.add_argument('--out', required=True)
+    synth.add_argument('--seed', type=int, default=0)
+    synth.set_defaults(func=bench_synth)
+
+    pipeline = commands.add_parser('pipeline', help="end-to-end benchmark on synthetic knowledge bases")
+    pipeline.add_argument('--sentences', type=int, nargs='+', default=[1000, 10000, 100000])
+    pipeline.add_argument('--queries', type=int, default=1000)
+    pipeline.add_argument('--concurrency', type=int, default=8)
+    pipeline.add_argument('--requests', type=int, default=2000, help="/chat requests in total")
+    pipeline.add_argument('--cache', action='store_true', help="keep the /chat answer cache on")
+    pipeline.add_argument('--seed', type=int, default=0)
+    pipeline.set_defaults(func=bench_pipeline)
+
+    loader = commands.add_parser('loader', help="in-memory vs streaming knowledge file loading")
+    loader.add_argument('--sentences', type=int, nargs='+', default=[10000, 100000])
+    loader.add_argument('--seed', type=int, default=0)
+    loader.set_defaults(func=bench_loader)
+
+    vectors = commands.add_parser('vectors', help="float64 vs float32 vs int8 sentence vectors")
+    vectors.add_argument('--sentences', type=int, nargs='+', default=[100000, 500000])
+    vectors.add_argument('--queries', type=int, default=300)
+    vectors.add_argument('--repeat', type=int, default=3)
+    vectors.add_argument('--seed', type=int, default=0)
+    vectors.set_defaults(func=bench_vectors)
+
+    shards = commands.add_parser('shards', help="sharded knowledge base search latency")
+    shards.add_argument('--sentences', type=int, default=200000)
+    shards.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    shards.add_argument('--queries', type=int, default=500)
+    shards.add_argument('--seed', type=int, default=0)
+    shards.set_defaults(func=bench_shards)
+
+    retrievers = commands.add_parser('retrievers', help="lexical vs dense (LSA + IVF) retrieval")
+    retrievers.add_argument('--sentences', type=int, default=20000)
+    retrievers.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    retrievers.add_argument('--queries', type=int, default=500)
+    retrievers.add_argument('--seed', type=int, default=0)
+    retrievers.set_defaults(func=bench_retrievers)
+
+    sections = commands.add_parser('sections', help="flat vs two-stage section-centroid search")
+    sections.add_argument('--sentences', type=int, default=50000)
+    sections.add_argument('--per-section', type=int, default=250)
+    sections.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8])
+    sections.add_argument('--flat-ratio', type=float, default=0.8)
+    sections.add_argument('--queries', type=int, default=300)
+    sections.add_argument('--seed', type=int, default=0)
+    sections.set_defaults(func=bench_sections)
+
+    scorers = commands.add_parser('scorers', help="TF-IDF cosine vs BM25 vs hybrid scoring")
+    scorers.add_argument('--sentences', type=int, default=20000)
+    scorers.add_argument('--queries', type=int, default=300)
+    scorers.add_argument('--seed', type=int, default=0)
+    scorers.set_defaults(func=bench_scorers)
+
+    spelling = commands.add_parser('spelling', help="fallback rate and cost of query spelling correction")
+    spelling.add_argument('--typos', type=int, default=1, help="misspelled words per question")
+    spelling.add_argument('--sentences', type=int, default=20000)
+    spelling.add_argument('--queries', type=int, default=300)
+    spelling.add_argument('--seed', type=int, default=0)
+    spelling.set_defaults(func=bench_spelling)
+
+    args = parser.parse_args(argv)
+    result = {'benchmark': args.command, 'python': sys.version.split()[0],
+              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+    result.update(args.func(args))
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,34 @@
+"""
+Gunicorn configuration for the APS Naturals Chatbot
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Settings can be overridden with environment variables:
+    PORT             port to listen on (default 5000)
+    WEB_CONCURRENCY  worker processes (default: one per CPU core)
+    WEB_THREADS      request threads per worker (default 4)
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Scoring is CPU-bound and holds the GIL, so scale with processes, not threads.
+# Answers are computed on app.py's bounded answer pool (CHAT_WORKERS); request
+# threads mostly wait there, and identical questions share one computation
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('WEB_THREADS', 4))
+
+# Import wsgi.py (and build the knowledge base) once in the master, then fork
+preload_app = True
+
+timeout = 30
+keepalive = 5
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    # Threads do not survive fork(), so each worker watches the knowledge file
+    from app import kb_reloader
+    kb_reloader.start_watching()
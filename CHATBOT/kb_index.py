@@ -0,0 +1,255 @@
+"""
+Prebuilt Index Module for APS Naturals Chatbot
+Writes the parsed and vectorized knowledge base to a versioned on-disk index
+and loads it back with memory-mapped arrays, so processes skip re-parsing the
+knowledge file and refitting the vectorizer at startup and share the pages.
+
+Usage:
+    python kb_index.py [knowledge_file] [--out INDEX_DIR] [--vector-dtype float32|int8]
+                       [--dedupe THRESHOLD]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from sentence_store import SentenceStore, SectionMap, SectionIndex
+
+# Bumped on every change to the files or meta.json keys, so an index written
+# by another version is rebuilt rather than misread:
+#   1  TF-IDF vectors, postings and sentence text
+#   2  vector_dtype (+ row_scales for int8), dedupe_threshold and compaction
+#      (+ folded_rows, source_section_ids, source_text, source_text_offsets
+#      when sentences were folded), words
+INDEX_FORMAT_VERSION = 2
+
+ARRAYS = ['idf', 'data', 'indices', 'indptr', 'postings_indptr', 'postings_indices',
+          'section_ids', 'text', 'text_offsets', 'words']
+
+
+def default_index_dir(knowledge_file):
+    """Index directory that sits next to the knowledge file"""
+    return os.path.splitext(knowledge_file)[0] + '.index'
+
+
+def file_sha256(path):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_fingerprint(path):
+    """Size, mtime and content hash identifying the knowledge file an index was built from"""
+    stat = os.stat(path)
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_sha256(path)
+    }
+
+
+def read_meta(index_dir):
+    """Read an index's metadata, or None if there is no readable index"""
+    try:
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_index_fresh(meta, knowledge_file, vectorizer_params, vector_dtype='float64', dedupe_threshold=None):
+    """Check an index was built by this format, with these settings, from this exact file"""
+    if not meta or meta.get('format_version') != INDEX_FORMAT_VERSION:
+        return False
+    if meta['vectorizer_params'] != vectorizer_params:
+        return False
+    if meta['vector_dtype'] != vector_dtype:
+        return False
+    if meta['dedupe_threshold'] != dedupe_threshold:
+        return False
+    return is_source_unchanged(meta['source'], knowledge_file)
+
+
+def is_source_unchanged(source, knowledge_file):
+    """Check a knowledge file still matches the source_fingerprint() it had"""
+    stat = os.stat(knowledge_file)
+    if stat.st_size != source['size']:
+        return False
+
+    # Same size and mtime: trust it without hashing the whole file
+    if stat.st_mtime_ns == source['mtime_ns']:
+        return True
+    return file_sha256(knowledge_file) == source['sha256']
+
+
+def encode_sentences(sentences):
+    """(UTF-8 buffer, offsets) of a sentence list, as read back by SentenceStore"""
+    encoded = [sentence.encode('utf-8') for sentence in sentences]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def save_index(kb, index_dir=None):
+    """Write a loaded KnowledgeBase to an index directory and return its path"""
+    if kb.vectorizer is None:
+        raise ValueError(f"Knowledge base {kb.knowledge_file} has no sentences to index")
+
+    index_dir = index_dir or default_index_dir(kb.knowledge_file)
+
+    section_names = list(kb.sections)
+    section_pos = {name: i for i, name in enumerate(section_names)}
+    section_ids = np.array([section_pos[name] for name in kb.section_map], dtype=np.int32)
+
+    text, text_offsets = encode_sentences(kb.all_sentences)
+
+    vectors = kb.sentence_vectors.tocsr()
+    vocabulary = sorted(kb.vectorizer.vocabulary_, key=kb.vectorizer.vocabulary_.get)
+
+    arrays = {
+        'idf': kb.vectorizer.idf_,
+        'data': vectors.data,
+        'indices': vectors.indices,
+        'indptr': vectors.indptr,
+        'postings_indptr': kb.postings_indptr,
+        'postings_indices': kb.postings_indices,
+        'section_ids': section_ids,
+        'text': text,
+        'text_offsets': text_offsets,
+        # Every word of the file, for spelling correction (see spelling.py)
+        'words': np.frombuffer('\n'.join(kb.known_words()).encode('utf-8'), dtype=np.uint8)
+    }
+    if kb.row_scales is not None:
+        arrays['row_scales'] = kb.row_scales
+    if kb.folded_rows is not None:
+        arrays['folded_rows'] = kb.folded_rows
+        arrays['source_section_ids'] = np.array([section_pos[name] for name in kb.source_section_map],
+                                                dtype=np.int32)
+        # Sentences folded away keep their own text under their section
+        arrays['source_text'], arrays['source_text_offsets'] = encode_sentences(kb.source_sentences)
+    meta = {
+        'format_version': INDEX_FORMAT_VERSION,
+        'source': source_fingerprint(kb.knowledge_file),
+        'vectorizer_params': kb.vectorizer_params,
+        'vector_dtype': kb.vector_dtype,
+        'dedupe_threshold': kb.dedupe_threshold,
+        'compaction': kb.compaction,
+        'shape': list(vectors.shape),
+        'vocabulary': vocabulary,
+        'sections': section_names
+    }
+
+    write_index_dir(index_dir, arrays, meta)
+    return index_dir
+
+
+def write_index_dir(index_dir, arrays, meta):
+    """Write .npy arrays and meta.json to index_dir, replacing it atomically"""
+    # Build next to the target and swap it in, so readers never see a partial index
+    tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, name + '.npy'), np.ascontiguousarray(array))
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+    old_dir = f"{index_dir}.old-{os.getpid()}"
+    if os.path.exists(index_dir):
+        os.rename(index_dir, old_dir)
+    os.rename(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def load_index(kb, index_dir, meta):
+    """Populate a KnowledgeBase from an index directory using memory-mapped arrays"""
+    from scipy.sparse import csr_matrix
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    names = ARRAYS + (['row_scales'] if meta['vector_dtype'] == 'int8' else [])
+    compaction = meta['compaction']
+    if compaction and compaction['kept'] < compaction['sentences']:
+        names += ['folded_rows', 'source_section_ids', 'source_text', 'source_text_offsets']
+    arrays = {name: np.load(os.path.join(index_dir, name + '.npy'), mmap_mode='r')
+              for name in names}
+
+    vectorizer = TfidfVectorizer(**meta['vectorizer_params'])
+    vectorizer.vocabulary_ = {term: i for i, term in enumerate(meta['vocabulary'])}
+    vectorizer.idf_ = arrays['idf']
+
+    offsets = arrays['text_offsets']
+    sentences = SentenceStore(arrays['text'], offsets[:-1], offsets[1:])
+    section_names = meta['sections']
+
+    kb.vectorizer = vectorizer
+    kb.sentence_vectors = csr_matrix(
+        (arrays['data'], arrays['indices'], arrays['indptr']),
+        shape=tuple(meta['shape']), copy=False)
+    kb.row_scales = arrays.get('row_scales')
+    kb.postings_indptr = arrays['postings_indptr']
+    kb.postings_indices = arrays['postings_indices']
+    kb.all_sentences = sentences
+    kb.section_map = SectionMap(arrays['section_ids'], section_names)
+    kb.sections = SectionIndex(sentences, arrays['section_ids'], section_names)
+    kb.compaction = compaction
+    kb.words = arrays['words'].tobytes().decode('utf-8').split('\n')
+    if 'folded_rows' in arrays:
+        # Every sentence of the file, with its own text, under its own section
+        source_offsets = arrays['source_text_offsets']
+        kb.folded_rows = arrays['folded_rows']
+        kb.source_section_map = SectionMap(arrays['source_section_ids'], section_names)
+        kb.source_sentences = SentenceStore(arrays['source_text'], source_offsets[:-1], source_offsets[1:])
+        kb.sections = SectionIndex(kb.source_sentences, arrays['source_section_ids'], section_names)
+        kb.index_folded_rows()
+
+
+def build_index(knowledge_file, index_dir=None, vector_dtype='float64', dedupe_threshold=None):
+    """Parse and vectorize a knowledge file from scratch and write its index"""
+    from knowledge_base import KnowledgeBase
+    kb = KnowledgeBase(knowledge_file, use_index=False, vector_dtype=vector_dtype,
+                       dedupe_threshold=dedupe_threshold)
+    return save_index(kb, index_dir), kb
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the prebuilt knowledge base index")
+    parser.add_argument('knowledge_file', nargs='?', default="dataset/apsnaturals_qa_dataset.txt")
+    parser.add_argument('--out', help="index directory (default: next to the knowledge file)")
+    parser.add_argument('--vector-dtype', choices=['float64', 'float32', 'int8'], default='float64',
+                        help="storage of the sentence vectors (must match KB_VECTOR_DTYPE)")
+    parser.add_argument('--dedupe', type=float, metavar='THRESHOLD',
+                        help="fold near-duplicate sentences (must match KB_DEDUPE_THRESHOLD)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.knowledge_file):
+        print(f"❌ Knowledge base file not found: {args.knowledge_file}")
+        return 1
+
+    print(f"📚 Building index for {args.knowledge_file}...")
+    start = time.perf_counter()
+    index_dir, kb = build_index(args.knowledge_file, args.out, args.vector_dtype, args.dedupe)
+    elapsed = time.perf_counter() - start
+
+    size = sum(os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir))
+    print(f"✅ Index written to {index_dir} in {elapsed:.2f}s")
+    print(f"   - {len(kb.all_sentences)} information pieces")
+    print(f"   - {len(kb.vectorizer.vocabulary_)} terms")
+    print(f"   - {kb.vector_dtype} sentence vectors")
+    if kb.compaction:
+        print(f"   - {kb.compaction['sentences'] - kb.compaction['kept']} near-duplicates folded "
+              f"(compaction ratio {kb.compaction['ratio']:.2f}x)")
+    print(f"   - {size / 1024:.1f} KiB on disk")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""
+Knowledge Base Registry Module for APS Naturals Chatbot
+Serves many tenants (brands), each with its own knowledge file, from one
+process.
+
+Tenants are the <name>.txt knowledge files of a directory, picked up when
+first asked for. A tenant's knowledge base is loaded on its first request
+(through its prebuilt index when there is one, see kb_index.py) and kept
+while it is in use; when the loaded tenants together take more than the
+memory budget, the least recently used ones are unloaded until they fit.
+An unloaded tenant is simply loaded again on its next request.
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+
+import numpy as np
+
+from kb_reloader import KnowledgeBaseReloader, file_signature
+from knowledge_base import KnowledgeBase
+
+TENANT_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$')
+
+# Objects never counted towards a knowledge base's size: code, and the
+# threads, locks and worker pools some knowledge bases hold
+_SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+                  types.MethodType)
+_SKIPPED_MODULES = ('threading', '_thread', 'concurrent', 'multiprocessing', 'queue', 'weakref', '_weakref')
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Approximate memory held by an object graph: array buffers plus Python
+    objects, each counted once (memory-mapped arrays count at full size)
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or obj is None or isinstance(obj, _SKIPPED_TYPES):
+        return 0
+    if type(obj).__module__.split('.')[0] in _SKIPPED_MODULES:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, memoryview):
+        return obj.nbytes
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool)):
+        return sys.getsizeof(obj)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return size + sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(deep_sizeof(item, seen) for item in obj)
+    if hasattr(obj, '__dict__'):
+        size += deep_sizeof(vars(obj), seen)
+    for slot in getattr(type(obj), '__slots__', ()):
+        size += deep_sizeof(getattr(obj, slot, None), seen)
+    return size
+
+
+class Tenant:
+    """One tenant's knowledge base snapshot, answer cache and counters"""
+
+    def __init__(self, name, knowledge_file, factory, answer_cache=None):
+        self.name = name
+        self.knowledge_file = knowledge_file
+        self.reloader = KnowledgeBaseReloader(knowledge_file, poll_interval=0, factory=factory)
+        self.answer_cache = answer_cache
+        self.requests = 0
+        self.hits = 0  # Requests served by a loaded knowledge base
+        self.misses = 0  # Requests that had to load it first
+        self.evictions = 0
+        self.last_load_seconds = None
+        self.resident_bytes = 0
+        self.last_used = None
+        self._sized = None  # Snapshot resident_bytes was measured on
+        self._load_lock = threading.Lock()
+
+    @property
+    def kb(self):
+        return self.reloader.current
+
+    @property
+    def loaded(self):
+        return self.reloader.current is not None
+
+    def load(self):
+        """Load the knowledge base if it is not loaded; returns True if it was loaded now"""
+        if self.loaded:
+            return False
+        with self._load_lock:
+            if self.loaded:
+                return False
+            start = time.perf_counter()
+            self.reloader.load()
+            self.last_load_seconds = time.perf_counter() - start
+            return True
+
+    def measure(self):
+        """Resident size of the current snapshot; True if it changed since last measured"""
+        kb = self.reloader.current
+        if kb is self._sized:
+            return False
+        self.resident_bytes = deep_sizeof(kb) if kb is not None else 0
+        self._sized = kb
+        return True
+
+    def unload(self):
+        kb = self.reloader.unload()
+        self._sized = None
+        self.resident_bytes = 0
+        if self.answer_cache is not None:
+            self.answer_cache.bind(None)  # Drops the answers and the cache's reference to kb
+        if hasattr(kb, 'close'):
+            kb.close()
+
+    def stats(self):
+        return {
+            'knowledge_file': self.knowledge_file,
+            'loaded': self.loaded,
+            'loads': self.reloader.loads,
+            'last_load_seconds': self.last_load_seconds,
+            'requests': self.requests,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / self.requests if self.requests else 0.0,
+            'evictions': self.evictions,
+            'resident_bytes': self.resident_bytes,
+            'last_used': self.last_used,
+            'answer_cache': self.answer_cache.stats() if self.answer_cache is not None else None
+        }
+
+
+class KnowledgeBaseRegistry:
+    """Tenant name -> lazily loaded knowledge base, within a total memory budget"""
+
+    def __init__(self, tenants_dir, factory=KnowledgeBase, memory_budget=512 << 20,
+                 answer_cache_factory=None, poll_interval=2.0):
+        self.tenants_dir = tenants_dir
+        self.factory = factory
+        self.memory_budget = memory_budget
+        self.answer_cache_factory = answer_cache_factory
+        self.poll_interval = poll_interval
+        self.tenants = {}
+        self.evictions = 0
+        self._loaded = OrderedDict()  # Loaded tenant names, least recently used first
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def tenant(self, name):
+        """The Tenant called name; raises KeyError if it has no knowledge file"""
+        if not isinstance(name, str) or not TENANT_NAME.match(name):
+            raise KeyError(name)
+        tenant = self.tenants.get(name)
+        if tenant is not None:
+            return tenant
+        knowledge_file = os.path.join(self.tenants_dir, name + '.txt')
+        if not os.path.isfile(knowledge_file):
+            raise KeyError(name)
+
+        with self._lock:
+            tenant = self.tenants.get(name)
+            if tenant is None:
+                cache = self.answer_cache_factory() if self.answer_cache_factory else None
+                tenant = self.tenants[name] = Tenant(name, knowledge_file, self.factory, cache)
+        return tenant
+
+    def get(self, name):
+        """
+        (knowledge base, Tenant) of the tenant called name, loading it if needed
+        and marking it most recently used
+        Raises KeyError for unknown tenants, RuntimeError if the load failed
+        """
+        tenant = self.tenant(name)
+        loaded_now = False
+        while True:
+            loaded_now |= tenant.load()
+            with self._lock:
+                # Evictions hold the lock too: load again if one happened since
+                kb = tenant.kb  # Kept by the caller even if the tenant is evicted later
+                if kb is None:
+                    continue
+                self._loaded[name] = tenant
+                self._loaded.move_to_end(name)
+                break
+
+        tenant.requests += 1
+        tenant.last_used = time.time()
+        if loaded_now:
+            tenant.misses += 1
+            self.start_watching()  # In the process serving requests, not a pre-fork master
+        else:
+            tenant.hits += 1
+        # A reload swaps in a new snapshot, so sizes are re-measured when they change
+        if tenant.measure() or loaded_now:
+            self.enforce_budget(keep=name)
+        return kb, tenant
+
+    @property
+    def loaded_count(self):
+        """Number of tenants whose knowledge base is in memory"""
+        return len(self._loaded)
+
+    def resident_bytes(self):
+        return sum(tenant.resident_bytes for tenant in list(self._loaded.values()))
+
+    def enforce_budget(self, keep=None):
+        """Unload least recently used tenants (never `keep`) until the loaded ones fit the budget"""
+        with self._lock:
+            while self.resident_bytes() > self.memory_budget:
+                victim = next((name for name in self._loaded if name != keep), None)
+                if victim is None:
+                    break
+                self._evict(victim)
+
+    def evict(self, name):
+        with self._lock:
+            if name in self._loaded:
+                self._evict(name)
+
+    def _evict(self, name):
+        tenant = self._loaded.pop(name)
+        tenant.unload()
+        tenant.evictions += 1
+        self.evictions += 1
+
+    def check(self):
+        """Reload loaded tenants whose knowledge file changed (see KnowledgeBaseReloader.check)"""
+        # Under the lock, so a tenant is never evicted between the check and
+        # the start of its rebuild (a rebuild started earlier is discarded)
+        with self._lock:
+            for tenant in self._loaded.values():
+                if file_signature(tenant.knowledge_file) is None:
+                    continue
+                tenant.reloader.check()
+
+    def start_watching(self):
+        """Poll the loaded tenants' knowledge files for changes in one daemon thread"""
+        if self.poll_interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+
+        def watch():
+            while True:
+                time.sleep(self.poll_interval)
+                try:
+                    self.check()
+                except Exception as e:
+                    print(f"❌ Error watching tenant knowledge bases: {e}")
+
+        self._watcher = threading.Thread(target=watch, name="kb-registry-watch", daemon=True)
+        self._watcher.start()
+
+    def stats(self):
+        """Summary for the /health endpoint"""
+        requests = sum(tenant.requests for tenant in self.tenants.values())
+        hits = sum(tenant.hits for tenant in self.tenants.values())
+        return {
+            'tenants_dir': self.tenants_dir,
+            'known': len(self.tenants),
+            'loaded': self.loaded_count,
+            'resident_bytes': self.resident_bytes(),
+            'memory_budget_bytes': self.memory_budget,
+            'requests': requests,
+            'hit_rate': hits / requests if requests else 0.0,
+            'evictions': self.evictions,
+            'watching': self._watcher is not None and self._watcher.is_alive()
+        }
+
+    def tenant_stats(self):
+        """Per-tenant load time, hit rate and resident size"""
+        return {name: tenant.stats() for name, tenant in sorted(self.tenants.items())}
@@ -0,0 +1,167 @@
+"""
+Knowledge Base Reloader Module for APS Naturals Chatbot
+Holds the knowledge base snapshot served by the web app and replaces it when
+the knowledge file changes, without restarting the server.
+
+A new KnowledgeBase is built in a background thread while requests keep using
+the current one; the swap is a single attribute assignment, so each request
+sees either the old or the new snapshot, never a mix.
+"""
+
+import os
+import threading
+import time
+
+from knowledge_base import KnowledgeBase
+
+
+def file_signature(path):
+    """(size, mtime) of a file, or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class KnowledgeBaseReloader:
+    """Current KnowledgeBase snapshot plus background rebuilds on change"""
+
+    def __init__(self, knowledge_file, poll_interval=2.0, factory=KnowledgeBase):
+        self.knowledge_file = knowledge_file
+        self.poll_interval = poll_interval
+        self.factory = factory
+        self.current = None  # Snapshot served to new requests
+        self.loads = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_build_seconds = None
+        self.loaded_at = None
+        self._signature = None  # File signature the current snapshot was built from
+        self._pending = None  # Changed signature seen by the watcher, not yet stable
+        self._generation = 0  # Bumped by unload(); rebuilds started before are dropped
+        self._build_lock = threading.Lock()
+        self._builder = None
+        self._watcher = None
+
+    def load(self):
+        """Build the first snapshot synchronously and return it"""
+        kb = self.current
+        while kb is None:
+            failures = self.failures
+            self._rebuild()
+            if self.failures != failures:
+                raise RuntimeError(self.last_error)
+            kb = self.current  # None again if unload() ran during the build
+        return kb
+
+    def reload(self, wait=False):
+        """
+        Rebuild the knowledge base in the background and swap it in when ready
+        Returns False if a rebuild is already running
+        """
+        with self._build_lock:
+            if self._builder is not None and self._builder.is_alive():
+                builder, started = self._builder, False
+            else:
+                builder = threading.Thread(target=self._rebuild, name="kb-reload", daemon=True)
+                builder.start()
+                self._builder, started = builder, True
+
+        if wait:
+            builder.join()
+        return started
+
+    def unload(self):
+        """
+        Drop the current snapshot and return it; a rebuild still running is
+        discarded when it finishes instead of being swapped in
+        """
+        with self._build_lock:
+            kb = self.current
+            self._generation += 1
+            self.current = None
+            self._signature = None
+            self._pending = None
+        return kb
+
+    def _rebuild(self):
+        generation = self._generation
+        signature = file_signature(self.knowledge_file)
+        start = time.perf_counter()
+        try:
+            kb = self.factory(self.knowledge_file)
+        except Exception as e:
+            # Keep serving the previous snapshot
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            print(f"❌ Error reloading knowledge base: {self.last_error}")
+            return
+
+        with self._build_lock:
+            if generation != self._generation:
+                stale = kb  # Unloaded while it was being built
+            else:
+                stale = None
+                self._signature = signature
+                self.current = kb
+        if stale is not None:
+            if hasattr(stale, 'close'):
+                stale.close()
+            return
+
+        self.last_build_seconds = time.perf_counter() - start
+        self.loaded_at = time.time()
+        self.last_error = None
+        if self.loads or self.failures:
+            print(f"🔄 Knowledge base reloaded: {len(kb.all_sentences)} information pieces "
+                  f"({self.last_build_seconds:.2f}s)")
+        self.loads += 1
+
+    def check(self):
+        """
+        Reload if the knowledge file changed
+        A change must be seen on two consecutive checks, so a file that is
+        still being written is not loaded half-way
+        """
+        signature = file_signature(self.knowledge_file)
+        if signature is None or signature == self._signature:
+            self._pending = None
+            return False
+
+        if signature != self._pending:
+            self._pending = signature
+            return False
+
+        self._pending = None
+        return self.reload()
+
+    def start_watching(self):
+        """Poll the knowledge file for changes in a daemon thread"""
+        if self.poll_interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+
+        def watch():
+            while True:
+                time.sleep(self.poll_interval)
+                try:
+                    self.check()
+                except Exception as e:
+                    print(f"❌ Error watching knowledge base: {e}")
+
+        self._watcher = threading.Thread(target=watch, name="kb-watch", daemon=True)
+        self._watcher.start()
+
+    def stats(self):
+        """Reload status for the /health endpoint"""
+        return {
+            'knowledge_file': self.knowledge_file,
+            'watching': self._watcher is not None and self._watcher.is_alive(),
+            'poll_interval_seconds': self.poll_interval,
+            'reloading': self._builder is not None and self._builder.is_alive(),
+            'loads': self.loads,
+            'failures': self.failures,
+            'last_build_seconds': self.last_build_seconds,
+            'loaded_at': self.loaded_at,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,157 @@
+"""
+Streaming Loader Module for APS Naturals Chatbot
+Builds a knowledge base from a knowledge file line by line, for files too
+large to read into memory at once.
+
+Sentences are kept as one compact UTF-8 buffer plus offsets and an integer
+section id per sentence (see sentence_store.py) instead of Python strings, and
+the TF-IDF vectors are built in two passes:
+
+1. while parsing, count each term's total and document frequency
+2. pick the vocabulary and IDF weights from those counts exactly as
+   TfidfVectorizer.fit() would, then transform the sentences in chunks
+
+The result is bit-for-bit identical to fitting TfidfVectorizer on all
+sentences at once, but peak memory stays close to the size of the final
+knowledge base.
+"""
+
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from sentence_store import SentenceStore, SectionMap, SectionIndex
+
+# Sentences vectorized per transform() call in the second pass
+STREAM_CHUNK_SENTENCES = 10000
+
+
+def parse_knowledge_file(knowledge_file):
+    """
+    Yield (section, sentence) for every sentence of a knowledge file, and
+    (section, None) for every section header, reading one line at a time;
+    same parsing rules as KnowledgeBase.load_knowledge
+    """
+    current_section = None
+    with open(knowledge_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+
+            # Skip comments and empty lines
+            if line.startswith('#') or not line:
+                continue
+
+            # Check for section headers
+            if line.startswith('[') and line.endswith(']'):
+                current_section = line[1:-1]
+                yield current_section, None
+            elif current_section:
+                yield current_section, line
+
+
+def _select_vocabulary(term_counts, max_features):
+    """
+    Term -> column mapping chosen exactly like CountVectorizer: terms sorted
+    alphabetically, then the max_features most frequent (same sort, same ties)
+    """
+    terms = sorted(term_counts)
+    if max_features is not None and len(terms) > max_features:
+        totals = np.array([term_counts[term] for term in terms], dtype=np.int64)
+        keep = np.sort((-totals).argsort()[:max_features])
+        terms = [terms[i] for i in keep]
+    return {term: i for i, term in enumerate(terms)}
+
+
+def _fit_order(counts, first_seen):
+    """
+    Reorder the entries of each row of a CSR count matrix by when their term
+    was first seen in the file: the order fit_transform() leaves them in, which
+    decides the summation order (and so the last bits) of the row norms
+    """
+    rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+    order = np.lexsort((first_seen[counts.indices], rows))
+    counts.indices = counts.indices[order]
+    counts.data = counts.data[order]
+    counts.has_sorted_indices = False
+    return counts
+
+
+def _smooth_idf(document_counts, vocabulary, n_documents):
+    """IDF weights as computed by TfidfTransformer(smooth_idf=True)"""
+    df = np.zeros(len(vocabulary), dtype=np.float64)
+    for term, column in vocabulary.items():
+        df[column] = document_counts[term]
+    df += 1.0
+    idf = np.full_like(df, fill_value=n_documents + 1, dtype=np.float64)
+    idf /= df
+    np.log(idf, out=idf)
+    idf += 1.0
+    return idf
+
+
+def load_streaming(kb, chunk_size=STREAM_CHUNK_SENTENCES):
+    """Populate a KnowledgeBase from its knowledge file without reading it whole"""
+    from scipy.sparse import vstack
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer, TfidfVectorizer
+
+    vectorizer = TfidfVectorizer(**kb.vectorizer_params)
+    analyze = vectorizer.build_analyzer()
+
+    # Pass 1: parse, store sentence bytes and count terms
+    text = bytearray()
+    offsets = array('q', [0])
+    section_ids = array('i')
+    section_pos = {}
+    term_counts = Counter()
+    document_counts = Counter()
+
+    for section, sentence in parse_knowledge_file(kb.knowledge_file):
+        section_id = section_pos.get(section)
+        if section_id is None:
+            section_id = section_pos[section] = len(section_pos)
+        if sentence is None:
+            continue
+
+        section_ids.append(section_id)
+        text += sentence.encode('utf-8')
+        offsets.append(len(text))
+
+        counts = Counter(analyze(sentence))
+        term_counts.update(counts)
+        document_counts.update(counts.keys())
+
+    section_names = list(section_pos)
+    section_ids = np.frombuffer(section_ids, dtype=np.int32)
+    offsets = np.frombuffer(offsets, dtype=np.int64)
+    sentences = SentenceStore(memoryview(text), offsets[:-1], offsets[1:])
+
+    kb.all_sentences = sentences
+    kb.section_map = SectionMap(section_ids, section_names)
+    kb.sections = SectionIndex(sentences, section_ids, section_names)
+    if not len(sentences):
+        return
+
+    # Pass 2: fix the vocabulary and IDF, then vectorize chunk by chunk
+    vocabulary = _select_vocabulary(term_counts, kb.vectorizer_params.get('max_features'))
+    first_seen = np.empty(len(vocabulary), dtype=np.int64)
+    for rank, term in enumerate(term_counts):
+        column = vocabulary.get(term)
+        if column is not None:
+            first_seen[column] = rank
+    del term_counts
+    vectorizer.vocabulary_ = vocabulary
+    vectorizer.idf_ = _smooth_idf(document_counts, vocabulary, len(sentences))
+    del document_counts
+
+    weighting = TfidfTransformer(norm=vectorizer.norm, use_idf=vectorizer.use_idf,
+                                 smooth_idf=vectorizer.smooth_idf,
+                                 sublinear_tf=vectorizer.sublinear_tf)
+    weighting.idf_ = vectorizer.idf_
+
+    chunks = []
+    for start in range(0, len(sentences), chunk_size):
+        counts = CountVectorizer.transform(vectorizer, sentences[start:start + chunk_size])
+        chunks.append(weighting.transform(_fit_order(counts, first_seen), copy=False))
+    kb.vectorizer = vectorizer
+    kb.sentence_vectors = vstack(chunks, format='csr') if len(chunks) > 1 else chunks[0]
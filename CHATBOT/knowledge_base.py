@@ -5,23 +5,192 @@ from the knowledge base to answer user questions dynamically.
 """
 
 import re
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
-from preprocessing import clean_text
+import os
+from collections import namedtuple
+import kb_index
+import kb_stream
+from metrics import Stopwatch
+from query_intent import classifier
+from sentence_store import SearchResults, SectionMap, SentenceStore
+
+# scikit-learn is imported on first use: it dominates import time and is not
+# needed by processes that only import this module
+
+
+# Upper bound on the query x sentence block scored at once by search_batch
+BATCH_SCORE_CELLS = 1 << 22
+
+# Knowledge files from this size up are loaded with the streaming loader
+STREAMING_THRESHOLD_BYTES = 32 << 20
+
+# Score ladder used to turn search results into answers:
+#   result  - results scoring at or below this are dropped
+#   answer  - the best result must reach this to answer at all
+#   support - further sentences must score above this to be added to an answer
+#             (also the bar for answering in the console chatbot)
+#   combine - the best result must score above this to combine several sentences
+ScoreThresholds = namedtuple('ScoreThresholds', ['result', 'answer', 'support', 'combine'])
+
+# Calibrated for cosine similarity of TF-IDF vectors; other scorers
+# calibrate their own (see retrievers.calibrate_thresholds)
+DEFAULT_THRESHOLDS = ScoreThresholds(result=0.1, answer=0.12, support=0.15, combine=0.2)
+
+# Storage types of the sentence vectors. float64 is scored with sklearn's
+# cosine_similarity, the reference. The rows are already L2-normalized, so
+# the compact types are scored with a plain dot product instead:
+#   float32 - half the bytes per value; scores within 1e-6 of float64
+#   int8    - an eighth of the bytes per value plus one scale per sentence;
+#             scores within 0.01 of float64 (see benchmark.py vectors)
+# Top-k lists can differ from float64 only where scores are that close.
+VECTOR_DTYPES = ('float64', 'float32', 'int8')
+
+
+def _top_k(scores, k):
+    """
+    Positions of the k highest scores, best first
+    Same order as a stable np.argsort(scores)[-k:][::-1] (equal scores: later
+    position first), but selected in O(n) with np.argpartition
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    
+    if k < n:
+        kth = scores[np.argpartition(scores, n - k)[n - k]]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)
+        top = np.concatenate((above, ties[len(ties) - (k - len(above)):]))
+    else:
+        top = np.arange(n)
+    
+    return top[np.lexsort((-top, -scores[top]))]
+
+
+def compact_vectors(vectors, dtype):
+    """
+    (vectors, row_scales) of L2-normalized sentence vectors stored as dtype
+    int8 rows are rescaled so their largest value is 127 and rounded;
+    row_scales (None for the float types) turns them back into floats
+    """
+    if dtype not in VECTOR_DTYPES:
+        raise ValueError(f"vector_dtype must be one of {VECTOR_DTYPES}, not {dtype!r}")
+    vectors = vectors.tocsr()
+    if dtype != 'int8':
+        return vectors.astype(dtype, copy=False), None
+
+    from scipy.sparse import csr_matrix
+    rows = np.repeat(np.arange(vectors.shape[0]), np.diff(vectors.indptr))
+    row_max = np.zeros(vectors.shape[0])
+    np.maximum.at(row_max, rows, np.abs(vectors.data))
+    row_scales = (row_max / 127.0).astype(np.float32)
+    safe = np.where(row_scales > 0, row_scales, 1.0)
+    data = np.rint(vectors.data / safe[rows]).astype(np.int8)
+    return csr_matrix((data, vectors.indices, vectors.indptr), shape=vectors.shape), row_scales
+
+
+def _cosine_rows(query_vector, vectors, row_scales=None):
+    """Cosine similarity of one query vector with every row of vectors"""
+    if vectors.dtype == np.float64:
+        from sklearn.metrics.pairwise import cosine_similarity
+        return cosine_similarity(query_vector, vectors)[0]
+    # Same product as _cosine_blocks, so search and search_batch agree exactly
+    return _cosine_blocks(query_vector, vectors, row_scales).toarray()[0]
+
+
+def _cosine_blocks(query_vectors, vectors, row_scales=None):
+    """Cosine similarities of query vectors x rows of vectors, as a sparse CSR matrix"""
+    if vectors.dtype == np.float64:
+        from sklearn.metrics.pairwise import cosine_similarity
+        return cosine_similarity(query_vectors, vectors, dense_output=False).tocsr()
+    scores = (query_vectors.astype(np.float32) @ vectors.T).tocsr()
+    if row_scales is not None:
+        scores.data *= row_scales[scores.indices]
+    return scores
+
+
+def _top_k_sparse_rows(scores, k):
+    """
+    Column indices and values of the k highest stored scores in each row of a
+    CSR matrix, best first, with the same tie order as _top_k
+    """
+    n_rows = scores.shape[0]
+    counts = np.diff(scores.indptr)
+    rows = np.repeat(np.arange(n_rows), counts)
+    
+    # One sort of all stored scores: by row, then best score, then later column
+    order = np.lexsort((-scores.indices, -scores.data, rows))
+    ranks = np.arange(len(order)) - scores.indptr[rows]
+    keep = order[ranks < k]
+    
+    splits = np.cumsum(np.minimum(counts, max(k, 0)))[:-1]
+    return np.split(scores.indices[keep], splits), np.split(scores.data[keep], splits)
+
 
 class KnowledgeBase:
-    def __init__(self, knowledge_file="dataset/apsnaturals_qa_dataset.txt"):
+    vectorizer_params = {'max_features': 500}
+    
+    def __init__(self, knowledge_file="dataset/apsnaturals_qa_dataset.txt", use_index=True,
+                 streaming=None, retriever=None, vector_dtype='float64', dedupe_threshold=None,
+                 spelling=False):
         self.knowledge_file = knowledge_file
+        self.use_index = use_index
+        self.streaming = streaming  # None: decide by file size (STREAMING_THRESHOLD_BYTES)
+        self.vector_dtype = vector_dtype  # Storage of sentence_vectors (see VECTOR_DTYPES)
+        self.dedupe_threshold = dedupe_threshold  # Fold near-duplicate sentences (see near_duplicates.py)
+        self.compaction = None  # Sentence counts before and after folding
+        self.folded_rows = None  # Row kept for every sentence of the file, once folded
+        self.folded_offsets = None  # Sentences folded into row i: folded_members[folded_offsets[i]:folded_offsets[i + 1]]
+        self.folded_members = None
+        self.source_section_map = None  # Section of every sentence of the file, once folded
+        self.source_sentences = None  # Every sentence of the file, once folded
+        self.retriever = None  # Alternative search backend (see retrievers.py)
+        self.speller = None  # Query spelling correction (see spelling.py)
+        self.words = None  # Every word of the knowledge file, once computed or loaded
+        self.index_dir = None  # Set when loaded from a prebuilt index
         self.sections = {}
         self.all_sentences = []
         self.section_map = []  # Maps sentence index to section name
         self.vectorizer = None
         self.sentence_vectors = None
+        self.row_scales = None  # Per-sentence scales of int8 sentence_vectors
+        self.postings_indptr = None  # Term -> sentence posting lists (CSC layout)
+        self.postings_indices = None
         self.load_knowledge()
+        if spelling and self.vectorizer is not None:
+            self.speller = self.build_speller()
+        if retriever is not None and self.all_sentences:
+            self.retriever = retriever(self)
+    
+    @property
+    def thresholds(self):
+        """Score thresholds for the scorer in use"""
+        return getattr(self.retriever, 'thresholds', DEFAULT_THRESHOLDS)
         
     def load_knowledge(self):
         """Load and parse the knowledge base file"""
+        # Serve from a prebuilt index when one matches the current file
+        if self.use_index:
+            index_dir = kb_index.default_index_dir(self.knowledge_file)
+            meta = kb_index.read_meta(index_dir)
+            if kb_index.is_index_fresh(meta, self.knowledge_file, self.vectorizer_params,
+                                       self.vector_dtype, self.dedupe_threshold):
+                kb_index.load_index(self, index_dir, meta)
+                self.index_dir = index_dir
+                return
+        
+        # Large files: parse line by line into a compact sentence store
+        streaming = self.streaming
+        if streaming is None:
+            streaming = os.path.getsize(self.knowledge_file) >= STREAMING_THRESHOLD_BYTES
+        if streaming:
+            kb_stream.load_streaming(self)
+            if self.vectorizer is not None:
+                self.fold_near_duplicates()
+                self.compact_vectors()
+                self.build_term_index()
+            return
+        
         with open(self.knowledge_file, 'r', encoding='utf-8') as f:
             content = f.read()
         
@@ -46,8 +215,119 @@ class KnowledgeBase:
         
         # Create TF-IDF vectors for all sentences
         if self.all_sentences:
-            self.vectorizer = TfidfVectorizer(max_features=500)
+            from sklearn.feature_extraction.text import TfidfVectorizer
+            self.vectorizer = TfidfVectorizer(**self.vectorizer_params)
             self.sentence_vectors = self.vectorizer.fit_transform(self.all_sentences)
+            self.fold_near_duplicates()
+            self.compact_vectors()
+            self.build_term_index()
+    
+    def fold_near_duplicates(self):
+        """
+        Keep one row per group of near-duplicate sentences (the first one)
+        when dedupe_threshold is set; self.sections still lists every
+        sentence under its section, and linked_sections() gives the sections
+        a kept sentence stands for
+        """
+        if self.dedupe_threshold is None:
+            return
+        from near_duplicates import find_near_duplicates
+        canonical = find_near_duplicates(self.all_sentences, self.vectorizer.build_analyzer(),
+                                         self.dedupe_threshold)
+        kept = canonical == np.arange(len(canonical))
+        keep = np.flatnonzero(kept)
+        self.compaction = {
+            'threshold': self.dedupe_threshold,
+            'sentences': len(canonical),
+            'kept': len(keep),
+            'ratio': len(canonical) / max(1, len(keep))
+        }
+        if len(keep) == len(canonical):
+            return
+        
+        self.folded_rows = (np.cumsum(kept) - 1)[canonical]
+        self.source_section_map = self.section_map
+        self.source_sentences = self.all_sentences
+        self.sentence_vectors = self.sentence_vectors[keep]
+        if isinstance(self.all_sentences, SentenceStore):
+            store = self.all_sentences
+            self.all_sentences = SentenceStore(store.buffer, store.starts[keep], store.ends[keep])
+            self.section_map = SectionMap(self.section_map.section_ids[keep], self.section_map.section_names)
+        else:
+            self.all_sentences = [self.all_sentences[i] for i in keep]
+            self.section_map = [self.section_map[i] for i in keep]
+        self.index_folded_rows()
+    
+    def index_folded_rows(self):
+        """Build folded_offsets/folded_members, the inverse of folded_rows (CSR-style)"""
+        counts = np.bincount(self.folded_rows, minlength=self.sentence_vectors.shape[0])
+        self.folded_offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.folded_members = np.argsort(self.folded_rows, kind='stable')  # File order within a row
+    
+    def linked_sections(self, sentence_id):
+        """Sections of a sentence and of the near-duplicates folded into it"""
+        if self.folded_rows is None:
+            return [self.section_map[sentence_id]]
+        folded = self.folded_members[self.folded_offsets[sentence_id]:self.folded_offsets[sentence_id + 1]]
+        return list(dict.fromkeys(self.source_section_map[i] for i in folded))
+    
+    def known_words(self):
+        """Every word of the knowledge file, as the vectorizer splits it"""
+        if self.words is None:
+            analyze = self.vectorizer.build_analyzer()
+            # self.sections lists every sentence, near-duplicates folded away included
+            self.words = sorted({word for sentences in self.sections.values()
+                                 for sentence in sentences for word in analyze(sentence)})
+        return self.words
+    
+    def build_speller(self):
+        """
+        SpellingCorrector onto the vocabulary; the more common term wins ties,
+        and words of the file or English stop words are never corrected
+        """
+        from spelling import SpellingCorrector
+        from stopwords_en import ENGLISH_STOP_WORDS
+        vocabulary = self.vectorizer.vocabulary_
+        idf = self.vectorizer.idf_
+        return SpellingCorrector(vocabulary, rank={term: idf[i] for term, i in vocabulary.items()},
+                                 known_words=set(self.known_words()) | set(ENGLISH_STOP_WORDS))
+    
+    def correct_query(self, query):
+        """query with misspelled words corrected, when spelling correction is on"""
+        if self.speller is None:
+            return query
+        watch = Stopwatch()
+        query = self.speller.correct(query)
+        watch.lap('kb_spelling')
+        return query
+    
+    def compact_vectors(self):
+        """Store the sentence vectors as vector_dtype"""
+        if self.vector_dtype != 'float64':
+            self.sentence_vectors, self.row_scales = compact_vectors(self.sentence_vectors, self.vector_dtype)
+    
+    def similarities(self, query_vector, candidates):
+        """Cosine similarity of a query vector with the candidate sentences"""
+        scales = None if self.row_scales is None else self.row_scales[candidates]
+        return _cosine_rows(query_vector, self.sentence_vectors[candidates], scales)
+    
+    def build_term_index(self):
+        """Build the term -> sentence posting lists used to prune search candidates"""
+        # A CSC copy of the sentence vectors is exactly an inverted index:
+        # the indices of column t are the (sorted) sentences containing term t
+        postings = self.sentence_vectors.tocsc()
+        postings.sort_indices()
+        self.postings_indptr = postings.indptr
+        self.postings_indices = postings.indices
+    
+    def candidate_sentences(self, term_ids):
+        """Sorted indices of the sentences sharing at least one of the given terms"""
+        if len(term_ids) == 0:
+            return np.empty(0, dtype=np.intp)
+        
+        indptr = self.postings_indptr
+        postings = [self.postings_indices[indptr[t]:indptr[t + 1]] for t in term_ids]
+        return np.unique(np.concatenate(postings))
     
     def search(self, query, top_k=5):
         """
@@ -57,26 +337,79 @@ class KnowledgeBase:
         if not self.all_sentences:
             return []
         
+        query = self.correct_query(query)
+        if self.retriever is not None:
+            watch = Stopwatch()
+            ids, scores = self.retriever.search(query, top_k)
+            watch.lap('kb_retriever')
+        else:
+            ids, scores = self.rank_tfidf(query, top_k)
+            watch = Stopwatch()
+        
+        results = self._make_results(ids, scores)
+        watch.lap('kb_results')
+        return results
+    
+    def rank_tfidf(self, query, top_k=5):
+        """Sentence ids and cosine similarities of the top_k TF-IDF matches, best first"""
+        watch = Stopwatch()
+        
         # Vectorize the query
         query_vector = self.vectorizer.transform([query])
+        watch.lap('kb_transform')
+        
+        # Only sentences sharing a term with the query can score above zero
+        candidates = self.candidate_sentences(query_vector.indices)
+        watch.lap('kb_candidates')
+        if len(candidates) == 0:
+            return candidates, np.empty(0)
         
-        # Calculate cosine similarity
-        similarities = cosine_similarity(query_vector, self.sentence_vectors)[0]
+        # Calculate cosine similarity against the candidates only
+        similarities = self.similarities(query_vector, candidates)
+        watch.lap('kb_cosine_similarity')
+        
+        top = _top_k(similarities, top_k)
+        watch.lap('kb_top_k')
+        return candidates[top], similarities[top]
+    
+    def search_batch(self, queries, top_k=5):
+        """
+        Search for many queries at once
+        Returns one result list per query, identical to calling search() on each
+        """
+        if not self.all_sentences or not queries:
+            return [[] for _ in queries]
+        if self.retriever is not None and not hasattr(self.retriever, 'search_batch'):
+            return [self.search(query, top_k) for query in queries]
+        if self.speller is not None:
+            queries = [self.correct_query(query) for query in queries]
+        if self.retriever is not None:
+            return [self._make_results(ids, scores)
+                    for ids, scores in self.retriever.search_batch(queries, top_k)]
         
-        # Get top_k indices
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        return [self._make_results(ids, scores)
+                for ids, scores in self.rank_tfidf_batch(queries, top_k)]
+    
+    def rank_tfidf_batch(self, queries, top_k=5):
+        """rank_tfidf() for many queries at once: one (ids, scores) pair per query"""
+        # One transform and one sparse product per block of queries
+        query_vectors = self.vectorizer.transform(queries)
+        block_size = max(1, BATCH_SCORE_CELLS // len(self.all_sentences))
         
-        # Prepare results
-        results = []
-        for idx in top_indices:
-            if similarities[idx] > 0.1:  # Minimum similarity threshold
-                results.append({
-                    'text': self.all_sentences[idx],
-                    'section': self.section_map[idx],
-                    'score': float(similarities[idx])
-                })
+        ranked = []
+        for start in range(0, len(queries), block_size):
+            # Sparse output: only sentences sharing a term with a query are stored
+            similarities = _cosine_blocks(query_vectors[start:start + block_size],
+                                          self.sentence_vectors, self.row_scales)
+            ranked.extend(zip(*_top_k_sparse_rows(similarities, top_k)))
         
-        return results
+        return ranked
+    
+    def _make_results(self, sentence_ids, scores):
+        """SearchResults of the ranked sentences above the similarity threshold"""
+        scores = np.asarray(scores, dtype=np.float64)
+        keep = scores > self.thresholds.result  # Minimum similarity threshold
+        return SearchResults(self.all_sentences, self.section_map, np.asarray(sentence_ids)[keep], scores[keep])
     
     def get_section(self, section_name):
         """Get all information from a specific section"""
@@ -94,11 +427,8 @@ class KnowledgeBase:
         
         # Group results by section for better context
         sections_used = {}
-        for result in results:
-            section = result['section']
-            if section not in sections_used:
-                sections_used[section] = []
-            sections_used[section].append(result['text'])
+        for i in range(len(results)):
+            sections_used.setdefault(results.section(i), []).append(results.text(i))
         
         # Format context
         context_parts = []
@@ -114,67 +444,76 @@ class KnowledgeBase:
         # Get relevant context
         results = self.search(query, top_k=5)
         
-        if not results or results[0]['score'] < 0.12:
+        watch = Stopwatch()
+        answer = self._compose_answer(query, results)
+        watch.lap('kb_compose_answer')
+        return answer
+    
+    def generate_answers_batch(self, queries):
+        """
+        Generate answers for many queries at once
+        Returns (answer, confidence) pairs, identical to calling generate_answer() on each
+        """
+        all_results = self.search_batch(queries, top_k=5)
+        query_classes = classifier.classify_batch(queries)
+        return [self._compose_answer(query, results, query_class)
+                for query, results, query_class in zip(queries, all_results, query_classes)]
+    
+    def _compose_answer(self, query, results, query_class=None):
+        """Build the answer for a query from its search results"""
+        thresholds = self.thresholds
+        if not results or results.scores[0] < thresholds.answer:
             return None, 0.0
+        scores = results.scores
         
         # Analyze query to determine what type of answer is needed
-        query_lower = query.lower()
-        
-        # Check if it's a yes/no question
-        is_yes_no = any(query_lower.startswith(word) for word in ['is', 'are', 'does', 'do', 'can', 'will', 'has', 'have'])
-        
-        # Check for specific question types
-        is_what = query_lower.startswith('what') or 'what' in query_lower
-        is_why = query_lower.startswith('why')
-        is_how = query_lower.startswith('how')
-        is_who = query_lower.startswith('who')
-        is_where = query_lower.startswith('where')
-        is_tell = 'tell' in query_lower or 'about' in query_lower
+        query_class = query_class or classifier.classify(query)
+        intent = query_class.intent
         
         # Get the most relevant information
-        top_info = results[0]['text']
-        confidence = results[0]['score']
+        top_info = results.text(0)
+        confidence = float(scores[0])
         
         # For yes/no questions, provide affirming answer
-        if is_yes_no:
+        if intent == 'yes_no':
             # Check if the information supports a positive answer
-            if any(word in query_lower for word in ['organic', 'natural', 'safe', 'eco', 'cruelty-free', 'sustainable', 'quality']):
+            if query_class.affirm:
                 answer = f"Yes, {top_info}"
             else:
                 answer = top_info
         
         # For 'what' questions or 'tell me about' questions
-        elif is_what or is_tell:
+        elif intent == 'what':
             # Combine multiple relevant points for richer answers
-            if len(results) > 1 and confidence > 0.2:
-                context_sentences = [r['text'] for r in results[:3] if r['score'] > 0.15]
+            if len(results) > 1 and confidence > thresholds.combine:
+                context_sentences = results.texts(np.flatnonzero(scores[:3] > thresholds.support))
                 answer = " ".join(context_sentences)
             else:
                 answer = top_info
         
         # For 'why' questions
-        elif is_why:
+        elif intent == 'why':
             # Combine multiple relevant points
-            context_sentences = [r['text'] for r in results[:3] if r['score'] > 0.15]
+            context_sentences = results.texts(np.flatnonzero(scores[:3] > thresholds.support))
             answer = " ".join(context_sentences)
         
         # For 'how' questions
-        elif is_how:
-            context_sentences = [r['text'] for r in results[:3] if r['score'] > 0.15]
+        elif intent == 'how':
+            context_sentences = results.texts(np.flatnonzero(scores[:3] > thresholds.support))
             answer = " ".join(context_sentences)
         
         # For 'who' questions
-        elif is_who:
+        elif intent == 'who':
             answer = top_info
         
         # For 'where' questions
-        elif is_where:
+        elif intent == 'where':
             answer = top_info
         
         # General questions - combine top results
         else:
-            if len(results) > 1 and confidence > 0.2:
-                context_sentences = [r['text'] for r in results[:3] if r['score'] > 0.15]
+            if len(results) > 1 and confidence > thresholds.combine:
+                context_sentences = results.texts(np.flatnonzero(scores[:3] > thresholds.support))
                 answer = " ".join(context_sentences)
             else:
                 answer = top_info
@@ -0,0 +1,262 @@
+"""
+Metrics Module for APS Naturals Chatbot
+Low-overhead counters, histograms and stage timers for the answer pipeline,
+rendered in the Prometheus text exposition format by the /metrics endpoint,
+plus an optional sampling profiler for hot-path analysis.
+"""
+
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+
+# Latency buckets in seconds (50us .. 5s)
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONFIDENCE_BUCKETS = (0.05, 0.1, 0.12, 0.15, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """A metric family; label values select a child that holds the numbers"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def total(self):
+        return sum(child.value for child in list(self._children.values()))
+
+    def _render_child(self, values, child):
+        yield f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}'
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', 'lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def _render_child(self, values, child):
+        with child.lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            cumulative += n
+            labels = _format_labels(self.labelnames, values, [('le', _format_value(bound))])
+            yield f'{self.name}_bucket{labels} {cumulative}'
+        labels = _format_labels(self.labelnames, values)
+        yield f'{self.name}_sum{labels} {_format_value(total)}'
+        yield f'{self.name}_count{labels} {count}'
+
+
+class Callback(_Metric):
+    """A gauge or counter whose value is computed when metrics are rendered"""
+
+    def __init__(self, name, documentation, function, kind='gauge'):
+        self.function = function
+        self.kind = kind
+        super().__init__(name, documentation)
+
+    def _new_child(self):
+        return None
+
+    def _render_child(self, values, child):
+        yield f'{self.name} {_format_value(self.function())}'
+
+
+class Registry:
+    """All metrics exposed on /metrics"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, function, kind='gauge'):
+        return self.register(Callback(name, documentation, function, kind))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'chatbot_stage_seconds', 'Time spent in each stage of answering a question', ['stage'])
+
+
+class Stopwatch:
+    """
+    Times consecutive stages of one call: each lap() records the time since
+    the previous lap (or since creation) under the given stage name
+    """
+
+    __slots__ = ('histogram', 'last')
+
+    def __init__(self, histogram=STAGE_SECONDS):
+        self.histogram = histogram
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.histogram.labels(stage).observe(now - self.last)
+        self.last = now
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: a background thread samples every other thread's
+    Python stack at a fixed interval and counts the collapsed stacks
+    (flame graph "folded" format: frame;frame;frame count)
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = collections.Counter()
+        self.started_at = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return False
+        with self._lock:
+            self.samples.clear()
+        self._stop.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self._stop.set()
+        self._thread.join()
+        return True
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)})')
+                    frame = frame.f_back
+                with self._lock:
+                    self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Samples in folded-stack format, most frequent first"""
+        with self._lock:
+            samples = self.samples.most_common()
+        return '\n'.join(f'{stack} {count}' for stack, count in samples) + '\n'
+
+
+profiler = SamplingProfiler()
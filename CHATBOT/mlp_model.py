@@ -0,0 +1,202 @@
+"""
+NumPy Model Module for APS Naturals Chatbot
+Runs the trained question classifier (model.py: TF-IDF -> Dense 128 relu ->
+Dense 64 relu -> softmax over the answers) without TensorFlow.
+
+The exporter copies the dense layer weights out of qa_model.h5, together with
+the vocabulary and IDF weights of vectorizer.pkl and the answers of
+answers.pkl, into one compressed .npz file. Inference is then a few NumPy
+matrix products per batch of questions: no TensorFlow import, no pickles,
+and the file loads in milliseconds.
+
+Usage:
+    python mlp_model.py [qa_model.h5] [--out qa_model.npz]
+"""
+
+import argparse
+import json
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+
+MODEL_FORMAT_VERSION = 1
+
+DEFAULT_MODEL_FILE = "qa_model.npz"
+
+
+def relu(x):
+    """max(x, 0), in place"""
+    return np.maximum(x, 0, out=x)
+
+
+def softmax(x):
+    """Row-wise softmax, in place"""
+    x -= x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+
+ACTIVATIONS = {'relu': relu, 'softmax': softmax, 'linear': lambda x: x}
+
+
+def read_h5_layers(h5_file):
+    """
+    [(kernel, bias, activation), ...] of the Dense layers of a Keras .h5 file
+    Reads the file with h5py when it is installed, otherwise through TensorFlow
+    """
+    try:
+        import h5py
+    except ImportError:
+        from tensorflow.keras.models import load_model
+        model = load_model(h5_file, compile=False)
+        return [(*layer.get_weights(), layer.get_config()['activation']) for layer in model.layers
+                if layer.__class__.__name__ == 'Dense']
+
+    def text(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+    with h5py.File(h5_file, 'r') as f:
+        config = json.loads(text(f.attrs['model_config']))
+        activations = {layer['config']['name']: layer['config']['activation']
+                       for layer in config['config']['layers'] if layer['class_name'] == 'Dense'}
+        weights = f['model_weights']
+
+        layers = []
+        for name in map(text, weights.attrs['layer_names']):
+            if name not in activations:
+                continue
+            group = weights[name]
+            kernel, bias = [np.asarray(group[text(weight)]) for weight in group.attrs['weight_names']]
+            layers.append((kernel, bias, activations[name]))
+        return layers
+
+
+def save_model(path, layers, vocabulary, idf, answers, ngram_range=(1, 1)):
+    """
+    Write a model file
+    layers: [(kernel, bias, activation), ...]; vocabulary: term -> column
+    """
+    terms = sorted(vocabulary, key=vocabulary.get)
+    arrays = {
+        'format_version': np.array(MODEL_FORMAT_VERSION),
+        'activations': np.array([activation for _, _, activation in layers]),
+        'vocabulary': np.array(terms),
+        'idf': np.asarray(idf, dtype=np.float64),
+        'ngram_range': np.array(ngram_range),
+        'answers': np.array(answers),
+    }
+    for i, (kernel, bias, _) in enumerate(layers):
+        arrays[f'kernel_{i}'] = np.asarray(kernel, dtype=np.float32)
+        arrays[f'bias_{i}'] = np.asarray(bias, dtype=np.float32)
+    np.savez_compressed(path, **arrays)
+    return path
+
+
+def export_model(h5_file="qa_model.h5", vectorizer_file="vectorizer.pkl",
+                 answers_file="answers.pkl", out=None):
+    """Convert the trained Keras model and its pickles into one model file"""
+    with open(vectorizer_file, 'rb') as f:
+        vectorizer = pickle.load(f)
+    with open(answers_file, 'rb') as f:
+        answers = pickle.load(f)
+
+    out = out or os.path.splitext(h5_file)[0] + '.npz'
+    return save_model(out, read_h5_layers(h5_file), vectorizer.vocabulary_, vectorizer.idf_, answers,
+                      vectorizer.ngram_range)
+
+
+class MLPModel:
+    """The question classifier, evaluated with NumPy"""
+
+    def __init__(self, model_file=DEFAULT_MODEL_FILE):
+        if not os.path.exists(model_file):
+            raise FileNotFoundError(f"{model_file} not found; export it with: python mlp_model.py")
+
+        with np.load(model_file, allow_pickle=False) as arrays:
+            if int(arrays['format_version']) != MODEL_FORMAT_VERSION:
+                raise ValueError(f"{model_file}: unsupported model format {int(arrays['format_version'])}")
+            activations = [str(activation) for activation in arrays['activations']]
+            self.layers = [(arrays[f'kernel_{i}'], arrays[f'bias_{i}'], ACTIVATIONS[activation])
+                           for i, activation in enumerate(activations)]
+            self.terms = [str(term) for term in arrays['vocabulary']]
+            self.idf = arrays['idf']
+            self.ngram_range = tuple(int(n) for n in arrays['ngram_range'])
+            self.answers = [str(answer) for answer in arrays['answers']]
+        self._vectorizer = None
+
+    @property
+    def vectorizer(self):
+        """TF-IDF vectorizer with the training vocabulary, as vectorizer.vectorize_data fitted it"""
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import TfidfVectorizer
+            vectorizer = TfidfVectorizer(ngram_range=self.ngram_range)
+            vectorizer.vocabulary_ = {term: i for i, term in enumerate(self.terms)}
+            vectorizer.idf_ = self.idf
+            self._vectorizer = vectorizer
+        return self._vectorizer
+
+    def vectorize(self, questions):
+        """TF-IDF vectors of raw questions, cleaned like the training questions"""
+        from preprocessing import get_normalizer
+        return self.vectorizer.transform(get_normalizer().clean_many(questions))
+
+    def predict_proba(self, vectors, batch_size=1024):
+        """Answer probabilities for a (sparse or dense) matrix of TF-IDF vectors, one row per question"""
+        n = vectors.shape[0]
+        probabilities = np.empty((n, len(self.answers)), dtype=np.float32)
+        for start in range(0, n, batch_size):
+            x = vectors[start:start + batch_size]
+            if hasattr(x, 'tocsr'):
+                x = x.tocsr().astype(np.float32)
+            else:
+                x = np.asarray(x, dtype=np.float32)
+            for kernel, bias, activation in self.layers:
+                x = x @ kernel
+                x += bias
+                x = activation(x)
+            probabilities[start:start + batch_size] = x
+        return probabilities
+
+    def predict(self, questions):
+        """(answer, probability) of the most likely answer to each question"""
+        probabilities = self.predict_proba(self.vectorize(questions))
+        best = probabilities.argmax(axis=1)
+        return [(self.answers[i], float(p[i])) for i, p in zip(best, probabilities)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the trained Keras model for NumPy inference")
+    parser.add_argument('model', nargs='?', default="qa_model.h5")
+    parser.add_argument('--vectorizer', default="vectorizer.pkl")
+    parser.add_argument('--answers', default="answers.pkl")
+    parser.add_argument('--out', help="model file (default: next to the .h5 file)")
+    args = parser.parse_args(argv)
+
+    for path in (args.model, args.vectorizer, args.answers):
+        if not os.path.exists(path):
+            print(f"❌ File not found: {path}")
+            return 1
+
+    print(f"🧠 Exporting {args.model}...")
+    start = time.perf_counter()
+    try:
+        out = export_model(args.model, args.vectorizer, args.answers, args.out)
+    except ImportError:
+        print("❌ Reading .h5 files needs h5py (pip install h5py) or TensorFlow")
+        return 1
+    elapsed = time.perf_counter() - start
+
+    model = MLPModel(out)
+    print(f"✅ Model written to {out} in {elapsed:.2f}s")
+    print(f"   - layers: {' -> '.join(str(kernel.shape[1]) for kernel, _, _ in model.layers)}")
+    print(f"   - {len(model.terms)} terms, {len(model.answers)} answers")
+    print(f"   - {os.path.getsize(out) / 1024:.1f} KiB on disk")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
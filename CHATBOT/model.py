@@ -1,10 +1,11 @@
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dense
 
-def build_model(input_size, output_size):
+def build_model(input_size, output_size, hidden_sizes=(128, 64)):
     model = Sequential()
-    model.add(Dense(128, activation='relu', input_shape=(input_size,)))
-    model.add(Dense(64, activation='relu'))
+    model.add(Dense(hidden_sizes[0], activation='relu', input_shape=(input_size,)))
+    for size in hidden_sizes[1:]:
+        model.add(Dense(size, activation='relu'))
     model.add(Dense(output_size, activation='softmax'))
 
     model.compile(
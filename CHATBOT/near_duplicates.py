@@ -0,0 +1,95 @@
+"""
+Near-Duplicate Module for APS Naturals Chatbot
+Finds knowledge sentences that say almost the same thing, so the knowledge
+base can keep one row for each group instead of scoring (and answering with)
+every variant.
+
+Two sentences are near-duplicates when the Jaccard similarity of their word
+sets reaches a threshold. Comparing every pair is quadratic, so candidates
+come from MinHash signatures split into LSH bands: sentences sharing any
+band are compared exactly, everything else is never looked at.
+
+Usage:
+    groups = find_near_duplicates(sentences, analyze, threshold=0.8)
+"""
+
+import zlib
+
+import numpy as np
+
+
+def lsh_bands(num_perm, threshold):
+    """
+    (bands, rows) with bands * rows == num_perm whose LSH curve rises below
+    threshold (at most 0.9 x threshold), so few pairs above it are missed;
+    the extra candidates cost one exact comparison each
+    """
+    options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    below = [option for option in options if (1.0 / option[0]) ** (1.0 / option[1]) <= 0.9 * threshold]
+    return max(below or options[:1], key=lambda option: (1.0 / option[0]) ** (1.0 / option[1]))
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class MinHasher:
+    """MinHash signatures of word sets, with num_perm multiply-shift hash functions"""
+
+    def __init__(self, num_perm=128, seed=1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, 1 << 63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+
+    def signatures(self, word_sets, block_size=4096):
+        """num_sentences x num_perm uint32 signatures; empty sets get all-ones rows"""
+        signatures = np.full((len(word_sets), self.num_perm), 0xFFFFFFFF, dtype=np.uint32)
+        for start in range(0, len(word_sets), block_size):
+            block = word_sets[start:start + block_size]
+            lengths = np.array([len(words) for words in block])
+            if not lengths.sum():
+                continue
+            # Stable 32-bit word hashes (Python's hash() changes between processes)
+            hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for words in block for word in words),
+                                 dtype=np.uint64, count=int(lengths.sum()))
+            with np.errstate(over='ignore'):
+                permuted = (self.a[:, None] * hashes[None, :] + self.b[:, None]) >> np.uint64(32)
+            present = np.flatnonzero(lengths)
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))[present]
+            signatures[start + present] = np.minimum.reduceat(permuted, starts, axis=1).T
+        return signatures
+
+
+def find_near_duplicates(sentences, analyze, threshold=0.8, num_perm=128):
+    """
+    Index of the canonical sentence of every sentence (its own index if it is
+    kept): the first sentence, in order, of each group of near-duplicates
+    analyze: text -> words, e.g. a vectorizer's build_analyzer()
+    """
+    word_sets = [frozenset(analyze(sentence)) for sentence in sentences]
+    canonical = np.arange(len(word_sets))
+    if len(word_sets) < 2:
+        return canonical
+
+    bands, rows = lsh_bands(num_perm, threshold)
+    signatures = MinHasher(num_perm).signatures(word_sets)
+    buckets = [{} for _ in range(bands)]
+
+    for i, words in enumerate(word_sets):
+        if not words:
+            continue
+        keys = [signatures[i, band * rows:(band + 1) * rows].tobytes() for band in range(bands)]
+        # Kept sentences sharing a band with this one; fold into the most similar
+        candidates = {kept for band, key in enumerate(keys) for kept in buckets[band].get(key, ())}
+        best, best_similarity = None, threshold
+        for kept in sorted(candidates):
+            similarity = jaccard(words, word_sets[kept])
+            if similarity >= best_similarity and (best is None or similarity > best_similarity):
+                best, best_similarity = kept, similarity
+        if best is not None:
+            canonical[i] = best
+            continue
+        for band, key in enumerate(keys):
+            buckets[band].setdefault(key, []).append(i)
+    return canonical
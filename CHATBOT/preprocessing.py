@@ -1,17 +1,100 @@
-import nltk
 import string
-from nltk.corpus import stopwords
+import threading
+
+from stopwords_en import ENGLISH_STOP_WORDS
+
+_stop_words = None
+_normalizer = None
+_lock = threading.Lock()
+
+
+def load_stop_words():
+    """
+    English stopwords, loaded on first use
+    Uses the NLTK corpus when it is installed and the bundled offline copy
+    otherwise; never downloads anything
+    """
+    try:
+        from nltk.corpus import stopwords
+        return frozenset(stopwords.words('english'))
+    except (ImportError, LookupError):
+        return ENGLISH_STOP_WORDS
+
+
+def get_normalizer():
+    """The shared TextNormalizer, built on first use"""
+    global _stop_words, _normalizer
+    if _normalizer is None:
+        with _lock:
+            if _normalizer is None:
+                _stop_words = load_stop_words()
+                _normalizer = TextNormalizer(_stop_words)
+    return _normalizer
+
+
+def __getattr__(name):
+    # Keep `from preprocessing import stop_words, normalizer` working without
+    # loading the stopwords at import time
+    if name == 'normalizer':
+        return get_normalizer()
+    if name == 'stop_words':
+        get_normalizer()
+        return _stop_words
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class TextNormalizer:
+    """clean_text with the punctuation table and stopword set built once"""
+
+    # Texts joined into one string per clean_many chunk
+    chunk_size = 1024
+
+    def __init__(self, stop_words):
+        self.table = str.maketrans('', '', string.punctuation)
+        self.stop_words = frozenset(stop_words)
+
+    def clean(self, text):
+        """Lowercase, strip punctuation and drop stopwords"""
+        stop_words = self.stop_words
+        return " ".join([word for word in text.lower().translate(self.table).split()
+                         if word not in stop_words])
+
+    __call__ = clean
+
+    def clean_many(self, texts):
+        """
+        Lazily clean an iterable of texts (e.g. lines of a file)
+        Each chunk is lowercased and translated as one string, which is much
+        cheaper than doing it text by text
+        """
+        chunk = []
+        for text in texts:
+            chunk.append(text)
+            if len(chunk) >= self.chunk_size:
+                yield from self._clean_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self._clean_chunk(chunk)
+
+    def _clean_chunk(self, texts):
+        joined = "\n".join(texts)
+        if joined.count("\n") != len(texts) - 1:
+            # A text contains a newline itself: clean one by one
+            return [self.clean(text) for text in texts]
+
+        stop_words = self.stop_words
+        return [" ".join([word for word in line.split() if word not in stop_words])
+                for line in joined.lower().translate(self.table).split("\n")]
 
-# Download stopwords quietly (only if not already downloaded)
-try:
-    stop_words = set(stopwords.words('english'))
-except LookupError:
-    nltk.download('stopwords', quiet=True)
-    stop_words = set(stopwords.words('english'))
 
 def clean_text(text):
-    text = text.lower()
-    text = text.translate(str.maketrans('', '', string.punctuation))
-    tokens = text.split()
-    tokens = [word for word in tokens if word not in stop_words]
-    return " ".join(tokens)
+    return (_normalizer or get_normalizer()).clean(text)
+
+
+def normalize_query(text):
+    """
+    Case- and whitespace-insensitive form of a query, used as a cache key.
+    Answers depend on stopwords and punctuation (question words, hyphenated
+    terms), so unlike clean_text this keeps them.
+    """
+    return " ".join(text.lower().split())
@@ -0,0 +1,149 @@
+"""
+Query Intent Module for APS Naturals Chatbot
+Classifies a question's intent (what kind of answer it needs, used by
+KnowledgeBase.generate_answer) and topic (which follow-up suggestions fit,
+used by app.py) in one pass.
+
+The rules are keyword rules: "starts with 'how'", "contains 'eco'", ...
+Keywords never contain whitespace, so a keyword occurs in a question exactly
+when it occurs in one of its whitespace-separated words, and a question
+starts with a keyword exactly when its first word does. Each distinct word
+is therefore matched against all keywords once and remembered as a bitmask;
+a question is classified by OR-ing the masks of its words and looking the
+combined mask up in a decision table.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+# Intent rules, checked in this order
+YES_NO_STARTS = ('is', 'are', 'does', 'do', 'can', 'will', 'has', 'have')
+INTENT_RULES = [
+    ('yes_no', 'starts', YES_NO_STARTS),
+    ('what', 'contains', ('what', 'tell', 'about')),  # What ... / Tell me about ...
+    ('why', 'starts', ('why',)),
+    ('how', 'starts', ('how',)),
+    ('who', 'starts', ('who',)),
+    ('where', 'starts', ('where',)),
+]
+DEFAULT_INTENT = 'general'
+
+# Words that make a yes/no question get a "Yes, ..." answer
+AFFIRM_WORDS = ('organic', 'natural', 'safe', 'eco', 'cruelty-free', 'sustainable', 'quality')
+
+# Topic rules, checked in this order
+TOPIC_RULES = [
+    ('products', ('product', 'offer', 'type', 'sell', 'have')),
+    ('quality', ('quality', 'safe', 'chemical', 'test', 'cruelty')),
+    ('sustainability', ('eco', 'environment', 'sustain', 'green', 'nature')),
+    ('usage', ('use', 'who', 'age', 'skin', 'daily', 'apply')),
+    ('company', ('mission', 'value', 'company', 'brand', 'different', 'about')),
+]
+DEFAULT_TOPIC = 'company'
+
+QueryClass = namedtuple('QueryClass', ['intent', 'topic', 'affirm'])
+
+
+class QueryClassifier:
+    """Keyword-rule classifier with memoized per-word keyword masks"""
+
+    def __init__(self, cache_size=1 << 16):
+        self.cache_size = cache_size
+
+        # One bit per distinct keyword: substrings in the low bits, prefixes above them
+        self.substrings = sorted({w for _, kind, words in INTENT_RULES if kind == 'contains' for w in words}
+                                 | set(AFFIRM_WORDS)
+                                 | {w for _, words in TOPIC_RULES for w in words})
+        self.prefixes = sorted({w for _, kind, words in INTENT_RULES if kind == 'starts' for w in words})
+        self.prefix_shift = len(self.substrings)
+        self.substring_bits = (1 << self.prefix_shift) - 1
+        bit = {('contains', w): 1 << i for i, w in enumerate(self.substrings)}
+        bit.update({('starts', w): 1 << (self.prefix_shift + i) for i, w in enumerate(self.prefixes)})
+
+        def mask(kind, words):
+            return sum(bit[kind, w] for w in set(words))
+
+        self.intent_masks = [(intent, mask(kind, words)) for intent, kind, words in INTENT_RULES]
+        self.affirm_mask = mask('contains', AFFIRM_WORDS)
+        self.topic_masks = [(topic, mask('contains', words)) for topic, words in TOPIC_RULES]
+        self.keyword_bits = [(w, bit['contains', w]) for w in self.substrings]
+        self.prefix_bits = [(w, bit['starts', w]) for w in self.prefixes]
+
+        self._word_masks = {}  # word -> keyword mask
+        self._decisions = {}  # question mask -> QueryClass
+        self._queries = {}  # question -> QueryClass
+
+    def _word_mask(self, word):
+        mask = self._word_masks.get(word)
+        if mask is None:
+            if len(self._word_masks) >= self.cache_size:
+                self._word_masks.clear()
+            mask = sum(b for w, b in self.keyword_bits if w in word)
+            mask += sum(b for w, b in self.prefix_bits if word.startswith(w))
+            self._word_masks[word] = mask
+        return mask
+
+    def _decide(self, mask):
+        decision = self._decisions.get(mask)
+        if decision is None:
+            intent = next((name for name, bits in self.intent_masks if mask & bits), DEFAULT_INTENT)
+            topic = next((name for name, bits in self.topic_masks if mask & bits), DEFAULT_TOPIC)
+            decision = self._decisions[mask] = QueryClass(intent, topic, bool(mask & self.affirm_mask))
+        return decision
+
+    def _question_mask(self, first, rest, leading_space):
+        """Substring bits of every word, prefix bits of the first word only"""
+        if leading_space:
+            first &= self.substring_bits
+        return first | (rest & self.substring_bits)
+
+    def classify(self, query):
+        """QueryClass (intent, topic, affirm) of one question"""
+        decision = self._queries.get(query)
+        if decision is not None:
+            return decision
+
+        query_lower = query.lower()
+        words = query_lower.split()
+        masks = self._word_masks
+        rest = 0
+        for word in words[1:]:
+            mask = masks.get(word)
+            rest |= self._word_mask(word) if mask is None else mask
+        first = self._word_mask(words[0]) if words else 0
+
+        decision = self._decide(self._question_mask(first, rest, query_lower[:1].isspace()))
+        if len(self._queries) >= self.cache_size:
+            self._queries.clear()
+        self._queries[query] = decision
+        return decision
+
+    def classify_batch(self, queries):
+        """classify() for many questions: each distinct word is matched once"""
+        lowered = [query.lower() for query in queries]
+        split = [query_lower.split() for query_lower in lowered]
+        counts = np.fromiter((len(words) for words in split), dtype=np.int64, count=len(split))
+
+        # Mask of every distinct word, then one OR-reduction per question
+        word_index = {}
+        positions = np.fromiter((word_index.setdefault(word, len(word_index))
+                                 for words in split for word in words),
+                                dtype=np.int64, count=int(counts.sum()))
+        masks = np.fromiter((self._word_mask(word) for word in word_index),
+                            dtype=np.uint64, count=len(word_index))[positions]
+
+        has_words = counts > 0
+        starts = (np.cumsum(counts) - counts)[has_words]
+        everything = np.zeros(len(queries), dtype=np.uint64)
+        first = np.zeros(len(queries), dtype=np.uint64)
+        if len(masks):
+            everything[has_words] = np.bitwise_or.reduceat(masks, starts)
+            first[has_words] = masks[starts]
+
+        return [self._decide(self._question_mask(int(f), int(e), query_lower[:1].isspace()))
+                for f, e, query_lower in zip(first, everything, lowered)]
+
+
+# Shared instance
+classifier = QueryClassifier()
@@ -0,0 +1,486 @@
+"""
+Retrievers Module for APS Naturals Chatbot
+Alternative search backends for KnowledgeBase.search.
+
+A retriever is built from a loaded knowledge base and has
+search(query, top_k) -> (sentence ids, scores), best first, plus the score
+`thresholds` (see knowledge_base.ScoreThresholds) its scores are judged by.
+Scores of different retrievers live on different scales, so each one
+calibrates its thresholds against the TF-IDF cosine ladder: at every level it
+lets through the same share of sample questions as the cosine scorer does,
+which keeps the fallback rate stable when the scorer is switched.
+
+BM25Retriever ranks with Okapi BM25 over the full vocabulary (TF-IDF is
+capped at 500 terms). TfidfRetriever wraps the knowledge base's own cosine
+scorer, and FusedRetriever combines the scores of several retrievers, e.g.
+lexical BM25 with the semantic DenseRetriever. MLPRetriever answers with
+the trained question classifier (qa_model.npz, see mlp_model.py).
+SectionRetriever gives the same cosine scores as the knowledge base but
+routes each question to its best [SECTION] blocks first, so large,
+well-sectioned catalogs are not scored sentence by sentence.
+
+DenseRetriever matches questions to sentences by meaning rather than by
+shared words: sentences and questions are projected into a small LSA
+"concept" space (truncated SVD of a TF-IDF matrix over the full vocabulary),
+so a question can match a sentence whose words often appear together with the
+question's words, even without sharing any of them.
+
+The sentence vectors are searched through an IVF (inverted file) index: the
+vectors are grouped into clusters and only the `nprobe` clusters closest to
+the question are scored. Higher nprobe finds more of the true nearest
+sentences (recall) at the cost of latency; nprobe >= n_lists is exact.
+The index is saved next to the knowledge file and memory-mapped on load.
+
+Usage:
+    kb = KnowledgeBase(retriever=BM25Retriever)
+    kb = KnowledgeBase(retriever=DenseRetriever)
+    kb = KnowledgeBase(retriever=functools.partial(DenseRetriever, nprobe=4))
+    kb = KnowledgeBase(retriever=MLPRetriever)
+    kb = KnowledgeBase(retriever=functools.partial(SectionRetriever, nprobe=3))
+    kb = KnowledgeBase(retriever=functools.partial(
+        FusedRetriever, retrievers=(BM25Retriever, DenseRetriever)))
+"""
+
+import os
+import random
+import re
+
+import numpy as np
+
+import kb_index
+from knowledge_base import DEFAULT_THRESHOLDS, ScoreThresholds, _top_k
+
+DENSE_INDEX_FORMAT_VERSION = 1
+
+DENSE_ARRAYS = ['idf', 'components', 'vectors', 'centroids', 'list_offsets', 'list_members']
+
+
+def default_dense_index_dir(knowledge_file):
+    """Dense index directory that sits next to the knowledge file"""
+    return os.path.splitext(knowledge_file)[0] + '.dense'
+
+
+def calibration_queries(kb, count=200, seed=0):
+    """
+    Sample questions for threshold calibration: a few words of one sentence,
+    half of them mixed with words of another sentence, so both strong and
+    weak matches are represented
+    """
+    rng = random.Random(seed)
+    sentences = kb.all_sentences
+    queries = []
+    for _ in range(count):
+        words = sentences[rng.randrange(len(sentences))].split()
+        query = rng.sample(words, min(len(words), rng.randint(2, 5)))
+        if rng.random() < 0.5:
+            other = sentences[rng.randrange(len(sentences))].split()
+            query += rng.sample(other, min(len(other), rng.randint(1, 2)))
+        queries.append(' '.join(query))
+    return queries
+
+
+def calibrate_thresholds(kb, search, queries=None, depth=10):
+    """
+    Thresholds for another scorer that let through the same share of scores
+    at each level as DEFAULT_THRESHOLDS do for TF-IDF cosine, matched on the
+    top `depth` result scores of the calibration questions
+    """
+    queries = queries or calibration_queries(kb)
+    reference = np.concatenate([scores for _, scores in kb.rank_tfidf_batch(queries, depth)])
+    scores = np.concatenate([search(query, depth)[1] for query in queries])
+    if len(reference) == 0 or len(scores) == 0:
+        return DEFAULT_THRESHOLDS
+
+    levels = [float(np.quantile(scores, 1.0 - np.mean(reference > level)))
+              for level in DEFAULT_THRESHOLDS]
+    return ScoreThresholds(*levels)
+
+
+class TfidfRetriever:
+    """The knowledge base's own TF-IDF cosine scorer, as a retriever (for fusion)"""
+
+    def __init__(self, kb):
+        self.kb = kb
+        self.thresholds = DEFAULT_THRESHOLDS
+
+    def search(self, query, top_k=5):
+        return self.kb.rank_tfidf(query, top_k)
+
+
+class BM25Retriever:
+    """
+    Okapi BM25 over the full vocabulary
+    The per-term weights of every sentence are computed once from the
+    sentence lengths and IDF array and kept in term -> sentence posting lists,
+    so a question only gathers and sums the postings of its terms
+    """
+
+    def __init__(self, kb, k1=1.2, b=0.75):
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        self.kb = kb
+        self.k1 = k1
+        self.b = b
+        # Same tokenization as the knowledge base's TF-IDF vectorizer
+        self.analyze = kb.vectorizer.build_analyzer()
+        counter = CountVectorizer(analyzer=self.analyze)
+        counts = counter.fit_transform(list(kb.all_sentences)).tocsr()
+        self.vocabulary = counter.vocabulary_
+
+        n_sentences, n_terms = counts.shape
+        self.sentence_lengths = np.asarray(counts.sum(axis=1)).ravel()
+        document_frequency = np.bincount(counts.indices, minlength=n_terms)
+        self.idf = np.log1p((n_sentences - document_frequency + 0.5) / (document_frequency + 0.5))
+
+        # BM25 weight of every (sentence, term) pair, in one vectorized pass
+        rows = np.repeat(np.arange(n_sentences), np.diff(counts.indptr))
+        tf = counts.data.astype(np.float64)
+        length_norm = 1.0 - b + b * self.sentence_lengths / self.sentence_lengths.mean()
+        counts.data = self.idf[counts.indices] * tf * (k1 + 1.0) / (tf + k1 * length_norm[rows])
+
+        postings = counts.tocsc()
+        postings.sort_indices()
+        self.postings_indptr = postings.indptr
+        self.postings_indices = postings.indices
+        self.postings_weights = postings.data
+
+        self.thresholds = calibrate_thresholds(kb, self.search)
+
+    def search(self, query, top_k=5):
+        """Sentence ids and normalized BM25 scores of the top_k sentences, best first"""
+        term_ids = {self.vocabulary[token] for token in self.analyze(query) if token in self.vocabulary}
+        if not term_ids:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        indptr = self.postings_indptr
+        spans = [slice(indptr[t], indptr[t + 1]) for t in sorted(term_ids)]
+        sentences = np.concatenate([self.postings_indices[span] for span in spans])
+        weights = np.concatenate([self.postings_weights[span] for span in spans])
+
+        candidates, position = np.unique(sentences, return_inverse=True)
+        scores = np.bincount(position, weights=weights)
+        top = _top_k(scores, top_k)
+        # Relative to the best score any sentence could get for this question,
+        # so short and long questions are judged on the same 0..1 scale
+        best_possible = self.idf[list(term_ids)].sum() * (self.k1 + 1.0)
+        return candidates[top], scores[top] / best_possible
+
+
+def spherical_kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """
+    Cluster unit-length vectors by cosine similarity
+    Returns (unit-length centroids, cluster id of each vector)
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        norms = np.linalg.norm(sums, axis=1)
+        filled = norms > 0  # Empty clusters keep their previous centroid
+        centroids[filled] = sums[filled] / norms[filled, None]
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class DenseRetriever:
+    """LSA sentence vectors served from an IVF approximate nearest neighbour index"""
+
+    vectorizer_params = {'sublinear_tf': True, 'stop_words': 'english'}
+
+    def __init__(self, kb, dimensions=128, n_lists=None, nprobe=8, use_index=True):
+        self.kb = kb
+        self.dimensions = dimensions
+        self.n_lists = n_lists  # None: about sqrt(number of sentences)
+        self.nprobe = nprobe
+        self.index_dir = None  # Set when loaded from or saved to disk
+        self.vectorizer = None
+        self.components = None  # Term -> concept projection (dimensions x terms)
+        self.vectors = None  # Unit-length sentence vectors (sentences x dimensions)
+        self.centroids = None
+        self.list_offsets = None  # Sentences of list i: list_members[list_offsets[i]:list_offsets[i + 1]]
+        self.list_members = None
+        self.thresholds = None
+
+        index_dir = default_dense_index_dir(kb.knowledge_file)
+        if not (use_index and self._load(index_dir)):
+            self.fit()
+            if use_index:
+                self.save(index_dir)
+        self.thresholds = calibrate_thresholds(kb, self.search)
+
+    @property
+    def params(self):
+        """Settings the on-disk index must have been built with"""
+        # Folding near-duplicates changes which sentence each row stands for
+        return {'dimensions': self.dimensions, 'n_lists': self.n_lists,
+                'vectorizer_params': self.vectorizer_params,
+                'dedupe_threshold': self.kb.dedupe_threshold,
+                'sentences': len(self.kb.all_sentences)}
+
+    def fit(self):
+        """Build the LSA projection and the IVF index from the knowledge base sentences"""
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        sentences = list(self.kb.all_sentences)
+        self.vectorizer = TfidfVectorizer(**self.vectorizer_params)
+        matrix = self.vectorizer.fit_transform(sentences)
+
+        # TruncatedSVD needs fewer components than both sentences and terms
+        dimensions = max(1, min(self.dimensions, matrix.shape[0] - 1, matrix.shape[1] - 1))
+        svd = TruncatedSVD(n_components=dimensions, random_state=0)
+        self.components = svd.fit(matrix).components_.astype(np.float32)
+        self.vectors = self._project(matrix)
+
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(sentences))))
+        n_lists = min(n_lists, len(sentences))
+        self.centroids, assignment = spherical_kmeans(self.vectors, n_lists)
+        self.list_members = np.argsort(assignment, kind='stable')
+        self.list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=self.list_offsets[1:])
+
+    def _project(self, matrix):
+        """Unit-length concept vectors for the rows of a TF-IDF matrix"""
+        vectors = np.asarray(matrix @ self.components.T, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    def save(self, index_dir=None):
+        """Write the dense index to disk and return its path"""
+        index_dir = index_dir or default_dense_index_dir(self.kb.knowledge_file)
+        vocabulary = sorted(self.vectorizer.vocabulary_, key=self.vectorizer.vocabulary_.get)
+        arrays = {
+            'idf': self.vectorizer.idf_,
+            'components': self.components,
+            'vectors': self.vectors,
+            'centroids': self.centroids,
+            'list_offsets': self.list_offsets,
+            'list_members': self.list_members
+        }
+        meta = {
+            'format_version': DENSE_INDEX_FORMAT_VERSION,
+            'source': kb_index.source_fingerprint(self.kb.knowledge_file),
+            'params': self.params,
+            'vocabulary': vocabulary
+        }
+        kb_index.write_index_dir(index_dir, arrays, meta)
+        self.index_dir = index_dir
+        return index_dir
+
+    def _load(self, index_dir):
+        """Load a dense index built from the current knowledge file with these settings"""
+        meta = kb_index.read_meta(index_dir)
+        if (not meta or meta.get('format_version') != DENSE_INDEX_FORMAT_VERSION
+                or meta.get('params') != self.params
+                or not kb_index.is_source_unchanged(meta['source'], self.kb.knowledge_file)):
+            return False
+
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        arrays = {name: np.load(os.path.join(index_dir, name + '.npy'), mmap_mode='r')
+                  for name in DENSE_ARRAYS}
+        self.vectorizer = TfidfVectorizer(**self.vectorizer_params)
+        self.vectorizer.vocabulary_ = {term: i for i, term in enumerate(meta['vocabulary'])}
+        self.vectorizer.idf_ = arrays['idf']
+        if arrays['vectors'].shape[0] != len(self.kb.all_sentences):
+            return False
+        for name in DENSE_ARRAYS[1:]:
+            setattr(self, name, arrays[name])
+        self.index_dir = index_dir
+        return True
+
+    def search(self, query, top_k=5, nprobe=None):
+        """Sentence ids and cosine scores of the top_k nearest sentences, best first"""
+        query_vector = self._project(self.vectorizer.transform([query]))[0]
+        if not query_vector.any():
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+
+        # Score the sentences of the nprobe closest clusters only
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        lists = _top_k(self.centroids @ query_vector, nprobe)
+        offsets = self.list_offsets
+        candidates = np.concatenate([self.list_members[offsets[i]:offsets[i + 1]] for i in lists])
+        candidates.sort()
+
+        scores = self.vectors[candidates] @ query_vector
+        top = _top_k(scores, top_k)
+        return candidates[top], scores[top]
+
+
+def section_ids(kb):
+    """Integer section id of every sentence, and the section names"""
+    if hasattr(kb.section_map, 'section_ids'):
+        return np.asarray(kb.section_map.section_ids), list(kb.section_map.section_names)
+    names = list(dict.fromkeys(kb.section_map))
+    position = {name: i for i, name in enumerate(names)}
+    return np.array([position[name] for name in kb.section_map], dtype=np.int32), names
+
+
+class SectionRetriever:
+    """
+    Two-stage TF-IDF cosine search: questions are first matched against one
+    centroid per [SECTION] (the normalized sum of its sentence vectors), and
+    only the sentences of the `nprobe` best sections are scored
+    When the section scores are flat (the best section left out scores at
+    least `flat_ratio` of the best one) the routing is not trusted and the
+    question is scored against every sentence, as without this retriever
+    """
+
+    def __init__(self, kb, nprobe=3, flat_ratio=0.8):
+        from sklearn.preprocessing import normalize
+
+        self.kb = kb
+        self.nprobe = nprobe
+        self.flat_ratio = flat_ratio
+        self.thresholds = DEFAULT_THRESHOLDS  # Same cosine scores as the knowledge base
+        self.searches = 0
+        self.fallbacks = 0
+
+        ids, self.section_names = section_ids(kb)
+        # Sentences grouped by section, like the IVF lists of DenseRetriever
+        self.list_members = np.argsort(ids, kind='stable')
+        counts = np.bincount(ids, minlength=len(self.section_names))
+        self.list_offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        # sections x sentences 0/1 matrix times the (L2-normalized) sentence
+        # vectors; int8 vectors are weighted by their scales
+        from scipy.sparse import csr_matrix
+        weights = np.ones(len(ids)) if kb.row_scales is None else kb.row_scales.astype(np.float64)
+        membership = csr_matrix((weights, (ids, np.arange(len(ids)))),
+                                shape=(len(self.section_names), len(ids)))
+        self.centroids = normalize(membership @ kb.sentence_vectors).tocsr()
+
+    def route(self, section_scores):
+        """Ids of the sections to score, or None to score every sentence"""
+        nprobe = min(self.nprobe, len(section_scores))
+        if nprobe == len(section_scores):
+            return None
+        top = _top_k(section_scores, nprobe + 1)
+        if section_scores[top[nprobe]] >= self.flat_ratio * section_scores[top[0]]:
+            return None
+        return top[:nprobe]
+
+    def _rank(self, query_vector, section_scores, top_k):
+        self.searches += 1
+        if not section_scores.any():
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        sections = self.route(section_scores)
+        if sections is None:
+            # Flat section scores: same candidates and scores as KnowledgeBase.rank_tfidf
+            self.fallbacks += 1
+            candidates = self.kb.candidate_sentences(query_vector.indices)
+        else:
+            offsets = self.list_offsets
+            candidates = np.concatenate([self.list_members[offsets[i]:offsets[i + 1]] for i in sections])
+            candidates.sort()
+
+        scores = self.kb.similarities(query_vector, candidates)
+        top = _top_k(scores, top_k)
+        return candidates[top], scores[top]
+
+    def search(self, query, top_k=5):
+        """Sentence ids and cosine similarities of the top_k sentences, best first"""
+        return self.search_batch([query], top_k)[0]
+
+    def search_batch(self, queries, top_k=5):
+        """search() for many queries: one transform and one centroid product"""
+        query_vectors = self.kb.vectorizer.transform(queries)
+        section_scores = (query_vectors @ self.centroids.T).toarray()
+        return [self._rank(query_vectors[i], section_scores[i], top_k) for i in range(len(queries))]
+
+    def stats(self):
+        return {
+            'sections': len(self.section_names),
+            'nprobe': self.nprobe,
+            'flat_ratio': self.flat_ratio,
+            'searches': self.searches,
+            'fallback_rate': self.fallbacks / self.searches if self.searches else 0.0
+        }
+
+
+class MLPRetriever:
+    """
+    The trained question classifier (mlp_model.py) as a retriever: every
+    answer the model can predict is mapped to its knowledge base sentence,
+    which is scored with the predicted probability of that answer
+    """
+
+    def __init__(self, kb, model_file=None):
+        from mlp_model import DEFAULT_MODEL_FILE, MLPModel
+
+        self.kb = kb
+        self.model = MLPModel(model_file or DEFAULT_MODEL_FILE)
+
+        # Sentences folded into a near-duplicate answer through the row kept for them
+        if kb.folded_rows is not None:
+            sentences, rows = kb.source_sentences, kb.folded_rows
+        else:
+            sentences, rows = kb.all_sentences, range(len(kb.all_sentences))
+        sentence_ids = {}
+        for sentence, row in zip(sentences, rows):
+            sentence_ids.setdefault(sentence, int(row))
+        # The training answers prefix some knowledge base sentences with "Yes, " / "No, "
+        answer_ids = [sentence_ids.get(re.sub(r'^(Yes|No), ', '', answer), -1)
+                      for answer in self.model.answers]
+
+        # answers x sentences 0/1 matrix that sums the probabilities of answers
+        # sharing a sentence; answers missing from the knowledge base are dropped
+        known = [i for i, sentence in enumerate(answer_ids) if sentence >= 0]
+        self.sentence_ids, column = np.unique([answer_ids[i] for i in known], return_inverse=True)
+        self.answer_sentences = np.zeros((len(answer_ids), len(self.sentence_ids)), dtype=np.float32)
+        self.answer_sentences[known, column] = 1.0
+
+        self.thresholds = calibrate_thresholds(kb, self.search)
+
+    def search_batch(self, queries, top_k=5):
+        """search() for many queries: one vectorization and one forward pass"""
+        vectors = self.model.vectorize(queries)
+        scores = (self.model.predict_proba(vectors) @ self.answer_sentences).astype(np.float64)
+        # A question without any known word carries no information
+        has_terms = np.diff(vectors.indptr) > 0
+
+        ranked = []
+        for row, informative in zip(scores, has_terms):
+            if not informative or len(self.sentence_ids) == 0:
+                ranked.append((np.empty(0, dtype=np.intp), np.empty(0)))
+                continue
+            top = _top_k(row, top_k)
+            ranked.append((self.sentence_ids[top], row[top]))
+        return ranked
+
+    def search(self, query, top_k=5):
+        """Sentence ids and answer probabilities of the top_k sentences, best first"""
+        return self.search_batch([query], top_k)[0]
+
+
+class FusedRetriever:
+    """
+    Weighted sum of the scores of several retrievers over the union of their
+    top `depth` sentences; each retriever's scores are first rescaled so its
+    calibrated answer threshold lines up with the cosine one
+    """
+
+    def __init__(self, kb, retrievers=(BM25Retriever, DenseRetriever), weights=None, depth=50):
+        self.kb = kb
+        self.retrievers = [retriever(kb) for retriever in retrievers]
+        weights = np.ones(len(self.retrievers)) if weights is None else np.asarray(weights, dtype=np.float64)
+        scales = np.array([DEFAULT_THRESHOLDS.answer / max(retriever.thresholds.answer, 1e-9)
+                           for retriever in self.retrievers])
+        self.factors = weights * scales / weights.sum()
+        self.depth = depth
+        self.thresholds = calibrate_thresholds(kb, self.search)
+
+    def search(self, query, top_k=5):
+        """Sentence ids and fused scores of the top_k sentences, best first"""
+        ranked = [retriever.search(query, self.depth) for retriever in self.retrievers]
+        sentences = np.concatenate([ids for ids, _ in ranked])
+        if len(sentences) == 0:
+            return sentences.astype(np.intp), np.empty(0)
+        weighted = np.concatenate([scores * factor for (_, scores), factor in zip(ranked, self.factors)])
+
+        candidates, position = np.unique(sentences, return_inverse=True)
+        scores = np.bincount(position, weights=weighted)
+        top = _top_k(scores, top_k)
+        return candidates[top], scores[top]
@@ -0,0 +1,162 @@
+"""
+Sentence Store Module for APS Naturals Chatbot
+Read-only, list-like views over sentences kept as one UTF-8 buffer plus
+offsets and an integer section id per sentence, so a knowledge base can be
+served straight from a memory-mapped index without building Python strings
+for every sentence up front; search results are kept the same way, as
+sentence ids and scores.
+"""
+
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+
+class SentenceStore(Sequence):
+    """Sentences stored as byte ranges of a single UTF-8 buffer"""
+
+    def __init__(self, buffer, starts, ends):
+        self.buffer = buffer
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return bytes(self.buffer[self.starts[idx]:self.ends[idx]]).decode('utf-8')
+
+
+class SectionMap(Sequence):
+    """Maps sentence index to section name, backed by an integer section id array"""
+
+    def __init__(self, section_ids, section_names):
+        self.section_ids = section_ids
+        self.section_names = section_names
+
+    def __len__(self):
+        return len(self.section_ids)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return self.section_names[self.section_ids[idx]]
+
+
+class SectionIndex(Mapping):
+    """Section name -> list of its sentences, resolved on access"""
+
+    def __init__(self, sentences, section_ids, section_names):
+        self.sentences = sentences
+        self.section_ids = section_ids
+        self.section_names = section_names
+        self._ids = {name: i for i, name in enumerate(section_names)}
+
+    def __len__(self):
+        return len(self.section_names)
+
+    def __iter__(self):
+        return iter(self.section_names)
+
+    def __getitem__(self, name):
+        section_id = self._ids[name]
+        return [self.sentences[i] for i in np.flatnonzero(self.section_ids == section_id)]
+
+
+class SearchResults(Sequence):
+    """
+    Ranked search hits as parallel arrays of sentence ids and scores
+    Text and section are looked up from the knowledge base only when asked
+    for; items are SearchResult views that also read like the result dicts
+    ({'text', 'section', 'score'}) search() used to return
+    """
+
+    __slots__ = ('sentences', 'section_map', 'ids', 'scores')
+
+    def __init__(self, sentences, section_map, ids, scores):
+        self.sentences = sentences
+        self.section_map = section_map
+        self.ids = ids
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return SearchResults(self.sentences, self.section_map, self.ids[idx], self.scores[idx])
+        if not -len(self.ids) <= idx < len(self.ids):
+            raise IndexError('search result index out of range')
+        return SearchResult(self, idx % len(self.ids))
+
+    def text(self, i):
+        return self.sentences[self.ids[i]]
+
+    def section(self, i):
+        return self.section_map[self.ids[i]]
+
+    def texts(self, positions):
+        """Texts of the hits at the given positions"""
+        return [self.sentences[i] for i in self.ids[positions]]
+
+    def as_dicts(self):
+        """The hits as {'text', 'section', 'score'} dicts"""
+        return [result.as_dict() for result in self]
+
+    def __eq__(self, other):
+        # Equal to another SearchResults or list of result dicts with the same hits
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return self.as_dicts() == [dict(result) for result in other]
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"SearchResults({self.as_dicts()!r})"
+
+
+class SearchResult(Mapping):
+    """One hit of a SearchResults; reads like {'text': ..., 'section': ..., 'score': ...}"""
+
+    __slots__ = ('results', 'index')
+
+    KEYS = ('text', 'section', 'score')
+
+    def __init__(self, results, index):
+        self.results = results
+        self.index = index
+
+    @property
+    def sentence_id(self):
+        return int(self.results.ids[self.index])
+
+    @property
+    def text(self):
+        return self.results.text(self.index)
+
+    @property
+    def section(self):
+        return self.results.section(self.index)
+
+    @property
+    def score(self):
+        return float(self.results.scores[self.index])
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def as_dict(self):
+        return {'text': self.text, 'section': self.section, 'score': self.score}
+
+    def __repr__(self):
+        return repr(self.as_dict())
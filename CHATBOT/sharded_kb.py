@@ -0,0 +1,239 @@
+"""
+Sharded Knowledge Base Module for APS Naturals Chatbot
+Splits the sentence vectors of one knowledge base into shards that are
+scored in parallel by worker processes, one process per shard.
+
+The vectorizer is fitted once on the whole knowledge file, so IDF weights
+are global and every shard scores exactly like the unsharded knowledge base.
+Each shard returns its own top-k; the merged top-k (same order, same tie
+order) is identical to KnowledgeBase.search.
+"""
+
+import multiprocessing
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from knowledge_base import (KnowledgeBase, BATCH_SCORE_CELLS, _cosine_blocks, _cosine_rows, _top_k,
+                            _top_k_sparse_rows)
+from metrics import Stopwatch
+
+
+# Shard processes start from a clean interpreter rather than a fork of the
+# searching process, which may be a threaded gunicorn worker (forking a
+# process with running threads can copy locks held by other threads)
+SHARD_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def csr_rows_view(matrix, start, end):
+    """Rows start:end of a CSR matrix sharing its data and indices (no copy)"""
+    indptr = matrix.indptr[start:end + 1]
+    begin, stop = indptr[0], indptr[-1]
+    # Assigned after construction: the constructor copies small views of large arrays
+    rows = csr_matrix((end - start, matrix.shape[1]), dtype=matrix.dtype)
+    rows.data = matrix.data[begin:stop]
+    rows.indices = matrix.indices[begin:stop]
+    rows.indptr = (indptr - begin).astype(matrix.indptr.dtype)
+    return rows
+
+
+class KnowledgeBaseShard:
+    """
+    A contiguous range of sentence vectors with its own term -> sentence postings
+    The postings are built by build_postings() in the worker process, so the
+    process that creates shards holds no copy of the vectors beyond its own
+    """
+
+    def __init__(self, sentence_vectors, offset, row_scales=None):
+        self.sentence_vectors = sentence_vectors
+        self.offset = offset  # Index of the shard's first sentence in the whole knowledge base
+        self.row_scales = row_scales  # Per-sentence scales of int8 vectors
+        self.postings_indptr = None
+        self.postings_indices = None
+
+    def build_postings(self):
+        postings = self.sentence_vectors.tocsc()
+        postings.sort_indices()
+        self.postings_indptr = postings.indptr
+        self.postings_indices = postings.indices
+
+    def search(self, query_vector, top_k):
+        """Global ids and scores of the shard's top_k sentences, best first"""
+        indptr = self.postings_indptr
+        postings = [self.postings_indices[indptr[t]:indptr[t + 1]] for t in query_vector.indices]
+        if not postings:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        candidates = np.unique(np.concatenate(postings))
+        if len(candidates) == 0:
+            return candidates, np.empty(0)
+
+        scales = None if self.row_scales is None else self.row_scales[candidates]
+        similarities = _cosine_rows(query_vector, self.sentence_vectors[candidates], scales)
+        top = _top_k(similarities, top_k)
+        return candidates[top] + self.offset, similarities[top]
+
+    def search_batch(self, query_vectors, top_k):
+        """search() for every row of query_vectors"""
+        block_size = max(1, BATCH_SCORE_CELLS // self.sentence_vectors.shape[0])
+
+        results = []
+        for start in range(0, query_vectors.shape[0], block_size):
+            similarities = _cosine_blocks(query_vectors[start:start + block_size],
+                                          self.sentence_vectors, self.row_scales)
+            for ids, scores in zip(*_top_k_sparse_rows(similarities, top_k)):
+                results.append((ids + self.offset, scores))
+        return results
+
+
+# The shard owned by a worker process
+_shard = None
+
+
+def _load_shard(shard):
+    global _shard
+    shard.build_postings()
+    _shard = shard
+
+
+def _search_shard(query_vector, top_k):
+    return _shard.search(query_vector, top_k)
+
+
+def _search_shard_batch(query_vectors, top_k):
+    return _shard.search_batch(query_vectors, top_k)
+
+
+def _merge_top_k(shard_results, k):
+    """
+    Merge per-shard (ids, scores) into the global top k, best first
+    Equal scores: later sentence first, as in _top_k
+    """
+    ids = np.concatenate([ids for ids, _ in shard_results])
+    scores = np.concatenate([scores for _, scores in shard_results])
+    order = np.lexsort((-ids, -scores))[:max(k, 0)]
+    return ids[order], scores[order]
+
+
+def shard_boundaries(section_map, weights, shards):
+    """
+    Split sentences into at most `shards` contiguous ranges of about equal
+    weight, cutting only where a new section starts
+    Returns the start of each range plus the total number of sentences
+    """
+    n = len(section_map)
+    starts = [i for i in range(1, n) if section_map[i] != section_map[i - 1]]
+    if not starts:
+        return [0, n]
+
+    starts = np.array(starts)
+    cumulative = np.concatenate(([0], np.cumsum(weights)))
+    targets = cumulative[-1] * np.arange(1, shards) / shards
+    # Nearest section start to each target weight
+    pos = np.searchsorted(cumulative[starts], targets)
+    cuts = set()
+    for target, p in zip(targets, pos):
+        nearby = [starts[j] for j in (p - 1, p) if 0 <= j < len(starts)]
+        cuts.add(int(min(nearby, key=lambda s: abs(cumulative[s] - target))))
+    return [0] + sorted(cuts) + [n]
+
+
+class ShardedKnowledgeBase(KnowledgeBase):
+    """
+    KnowledgeBase whose searches fan out to one worker process per shard
+    Worker processes are started on the first search, in the process that
+    searches, and are shut down when the knowledge base is garbage collected
+    or close() is called. A pre-fork master that searches (wsgi.py precomputes
+    the answer table) must close() before forking, so the pools are not
+    inherited by the workers
+    """
+
+    def __init__(self, knowledge_file="dataset/apsnaturals_qa_dataset.txt", use_index=True,
+                 streaming=None, retriever=None, vector_dtype='float64', dedupe_threshold=None,
+                 spelling=False, shards=None):
+        self.shards = []
+        self._executors = None
+        self._executors_pid = None
+        self._finalizer = None
+        self._pool_lock = threading.Lock()
+        self.shard_count = shards or os.cpu_count() or 1
+        super().__init__(knowledge_file, use_index=use_index, streaming=streaming,
+                         retriever=retriever, vector_dtype=vector_dtype,
+                         dedupe_threshold=dedupe_threshold, spelling=spelling)
+
+    def load_knowledge(self):
+        """Load the knowledge base, then split it into shards"""
+        super().load_knowledge()
+        self.build_shards(self.shard_count)
+
+    def build_shards(self, count):
+        """Partition the sentence vectors into at most `count` shards"""
+        self.close()
+        self.shards = []
+        if not self.all_sentences:
+            return
+
+        vectors = self.sentence_vectors.tocsr()
+        boundaries = shard_boundaries(self.section_map, np.diff(vectors.indptr) + 1, count)
+        for start, end in zip(boundaries[:-1], boundaries[1:]):
+            scales = None if self.row_scales is None else self.row_scales[start:end]
+            self.shards.append(KnowledgeBaseShard(csr_rows_view(vectors, start, end), start, scales))
+
+    def _pool(self):
+        """One single-process executor per shard, started on first use in this process"""
+        with self._pool_lock:
+            if self._executors is None or self._executors_pid != os.getpid():
+                context = multiprocessing.get_context(SHARD_START_METHOD)
+                self._executors = [ProcessPoolExecutor(max_workers=1, mp_context=context,
+                                                       initializer=_load_shard, initargs=(shard,))
+                                   for shard in self.shards]
+                self._executors_pid = os.getpid()
+                self._finalizer = weakref.finalize(self, _shutdown, self._executors)
+            return self._executors
+
+    def close(self):
+        """Stop the shard worker processes"""
+        if self._finalizer is not None and self._executors_pid == os.getpid():
+            self._finalizer()
+        self._executors = None
+        self._finalizer = None
+
+    def rank_tfidf(self, query, top_k=5):
+        """Same ranking as KnowledgeBase.rank_tfidf, scored shard by shard in parallel"""
+        watch = Stopwatch()
+        query_vector = self.vectorizer.transform([query])
+        watch.lap('kb_transform')
+        if len(query_vector.indices) == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        futures = [executor.submit(_search_shard, query_vector, top_k) for executor in self._pool()]
+        shard_results = [future.result() for future in futures]
+        watch.lap('kb_shard_search')
+
+        ranked = _merge_top_k(shard_results, top_k)
+        watch.lap('kb_top_k')
+        return ranked
+
+    def rank_tfidf_batch(self, queries, top_k=5):
+        """Same ranking as KnowledgeBase.rank_tfidf_batch, scored shard by shard in parallel"""
+        query_vectors = self.vectorizer.transform(queries)
+        futures = [executor.submit(_search_shard_batch, query_vectors, top_k)
+                   for executor in self._pool()]
+        per_shard = [future.result() for future in futures]
+        return [_merge_top_k(shard_results, top_k) for shard_results in zip(*per_shard)]
+
+    def stats(self):
+        """Shard layout for the /health endpoint"""
+        return {
+            'shards': len(self.shards),
+            'sentences_per_shard': [shard.sentence_vectors.shape[0] for shard in self.shards],
+            'workers_running': self._executors is not None and self._executors_pid == os.getpid()
+        }
+
+
+def _shutdown(executors):
+    for executor in executors:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,120 @@
+"""
+Single-Flight Module for APS Naturals Chatbot
+Runs answer generation on a small, bounded pool of threads and coalesces
+identical work: while a question is being answered, every other request for
+the same question waits for that one computation instead of starting its
+own. A burst of clicks on the same suggestion button then costs one
+generate_answer call.
+
+Callers can block (SingleFlight.do, used by the WSGI /chat view) or await
+(SingleFlight.do_async, for code running on an asyncio event loop); either
+way the CPU-bound work runs on the executor's threads, not the caller's, so
+an event loop keeps serving other requests meanwhile.
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Overloaded(Exception):
+    """The executor already has max_pending computations queued or running"""
+
+
+class BoundedExecutor:
+    """
+    Thread pool that accepts at most max_pending unfinished tasks and rejects
+    the rest (Overloaded) instead of queueing without limit
+    Threads are started on first use in the process that submits, so a
+    pre-forking server's master does not hand dead threads to its workers
+    """
+
+    def __init__(self, max_workers=1, max_pending=64):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='chat-worker')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise Overloaded(f"{self.max_pending} computations already pending")
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+class SingleFlight:
+    """At most one in-flight computation per key; concurrent callers share its result"""
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.started = 0  # Computations run
+        self.shared = 0  # Calls that joined a computation already in flight
+        self._calls = {}  # key -> Future of the computation in flight
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args):
+        """Future of fn(*args), shared with any call for the same key still in flight"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.shared += 1
+                return future
+            future = self.executor.submit(fn, *args)
+            self._calls[key] = future
+            self.started += 1
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    @property
+    def in_flight(self):
+        """Number of computations running or queued"""
+        return len(self._calls)
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def do(self, key, fn, *args, timeout=None):
+        """Blocking: the result of fn(*args), computed once for concurrent callers"""
+        return self.submit(key, fn, *args).result(timeout)
+
+    async def do_async(self, key, fn, *args, timeout=None):
+        """
+        Awaitable do(): the event loop stays free while fn runs, and coroutines
+        awaiting the same key share one computation
+        Raises Overloaded like do(), and asyncio.TimeoutError after timeout
+        seconds (the shared computation itself keeps running)
+        """
+        future = asyncio.wrap_future(self.submit(key, fn, *args))
+        # shield: a caller timing out or being cancelled must not cancel the
+        # computation other callers are waiting for
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+    def stats(self):
+        """Counters for the /health endpoint"""
+        return {
+            'in_flight': self.in_flight,
+            'started': self.started,
+            'shared': self.shared,
+            'rejected': self.executor.rejected,
+            'max_workers': self.executor.max_workers,
+            'max_pending': self.executor.max_pending
+        }
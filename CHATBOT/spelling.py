@@ -0,0 +1,143 @@
+"""
+Spelling Module for APS Naturals Chatbot
+Corrects misspelled query words ("organik", "sustanability") to terms of the
+knowledge base vocabulary before the query is vectorized, so a typo no longer
+turns a question into an empty vector and the fallback reply.
+
+Lookups use a symmetric-delete index (as in SymSpell): every vocabulary term
+is stored under each string obtained by deleting up to two of its
+characters. Two words within n edits (an adjacent transposition counting as
+one) share such a deletion of at most n characters each, so a misspelled
+word's own deletions find every close term with a few dict lookups instead
+of comparing it with the whole vocabulary; only those few candidates get an
+exact edit distance.
+
+Only words the knowledge base has never seen are corrected: a real word that
+just did not make it into the TF-IDF vocabulary (max_features) is left
+alone, as are short words, words with digits and plurals or singulars of
+vocabulary terms ("offer" does not become "offers").
+
+Usage:
+    speller = SpellingCorrector(kb.vectorizer.vocabulary_, known_words=words)
+    speller.correct("are your products organik")  # "are your products organic"
+"""
+
+import functools
+import re
+
+TOKEN = re.compile(r'(?u)\b\w\w+\b')  # TfidfVectorizer's default token_pattern
+
+
+def deletions(word, distance):
+    """word with up to `distance` characters deleted (word itself included)"""
+    variants = {word}
+    frontier = [word]
+    for _ in range(distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier if len(variant) > 1
+                    for i in range(len(variant))} - variants
+        variants |= frontier
+    return variants
+
+
+def edit_distance(a, b, limit):
+    """
+    Optimal string alignment distance (insertions, deletions, substitutions
+    and adjacent transpositions), or any number above limit once it is known
+    to exceed it
+    """
+    # The common prefix and suffix of a typo and its word cost nothing
+    start = 0
+    while start < min(len(a), len(b)) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < min(len(a), len(b)) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous2 is not None and j > 1 and a[i - 1] == b[j - 2]
+                    and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class SpellingCorrector:
+    """
+    Maps unknown query words to the closest vocabulary term
+    terms: the correction targets (e.g. vectorizer.vocabulary_)
+    rank: term -> tie-break key, lower wins among equally close terms
+          (e.g. IDF, so the more common term is picked)
+    known_words: words that are never corrected (every word of the knowledge base)
+    """
+
+    def __init__(self, terms, rank=None, known_words=(), max_distance=2, min_length=5, cache_size=4096):
+        self.terms = frozenset(terms)
+        self.rank = rank or {}
+        self.known_words = frozenset(known_words) | self.terms
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.corrected = 0  # Words replaced
+        self.unknown = 0  # Unknown words left as they are
+
+        self.deletes = {}  # Deletion variant -> terms it comes from
+        for term in self.terms:
+            for variant in deletions(term, max_distance):
+                self.deletes.setdefault(variant, []).append(term)
+        self.correct_word = functools.lru_cache(maxsize=cache_size)(self._correct_word)
+
+    def allowed_distance(self, word):
+        """Edits allowed for a word: none if short, 1 up to 7 letters, then max_distance"""
+        if len(word) < self.min_length:
+            return 0
+        return 1 if len(word) < 8 else self.max_distance
+
+    def _correct_word(self, word):
+        """The closest term to an unknown word, or None"""
+        limit = self.allowed_distance(word)
+        if not limit or any(c.isdigit() for c in word):
+            return None
+
+        candidates = {term for variant in deletions(word, limit)
+                      for term in self.deletes.get(variant, ())}
+        best, best_key = None, None
+        for term in candidates:
+            distance = edit_distance(word, term, limit)
+            if distance > limit or term == word + 's' or word == term + 's':
+                continue  # A plural or singular is another word, not a typo
+            key = (distance, self.rank.get(term, 0.0), term)
+            if best_key is None or key < best_key:
+                best, best_key = term, key
+        return best
+
+    def correct(self, text):
+        """text with unknown words replaced by their correction (in lowercase)"""
+        def replace(match):
+            word = match.group().lower()
+            if word in self.known_words:
+                return match.group()
+            term = self.correct_word(word)
+            if term is None:
+                self.unknown += 1
+                return match.group()
+            self.corrected += 1
+            return term
+
+        return TOKEN.sub(replace, text)
+
+    def stats(self):
+        return {
+            'terms': len(self.terms),
+            'known_words': len(self.known_words),
+            'delete_variants': len(self.deletes),
+            'corrected': self.corrected,
+            'unknown': self.unknown
+        }
@@ -0,0 +1,36 @@
+"""
+Checks that a knowledge base served from its prebuilt index matches one
+loaded from the knowledge file. Run: python -m pytest test_kb_index.py
+"""
+
+from kb_index import build_index, default_index_dir
+from knowledge_base import KnowledgeBase
+
+KNOWLEDGE = """\
+[PRODUCTS]
+APS Naturals offers herbal skincare products for daily use.
+APS Naturals offers herbal skincare products for daily use too.
+The products are suitable for sensitive skin.
+
+[SUSTAINABILITY]
+APS Naturals uses eco-friendly packaging.
+APS Naturals offers herbal skincare products for everyday daily use.
+"""
+
+
+def test_sections_match_after_index_load_with_dedupe(tmp_path):
+    knowledge_file = tmp_path / "kb.txt"
+    knowledge_file.write_text(KNOWLEDGE, encoding='utf-8')
+
+    live = KnowledgeBase(str(knowledge_file), use_index=False, dedupe_threshold=0.8)
+    assert live.compaction['kept'] < live.compaction['sentences']
+
+    build_index(str(knowledge_file), dedupe_threshold=0.8)
+    indexed = KnowledgeBase(str(knowledge_file), dedupe_threshold=0.8)
+    assert indexed.index_dir == default_index_dir(str(knowledge_file))
+
+    assert list(indexed.sections) == list(live.sections)
+    for section in live.sections:
+        assert indexed.get_section(section) == live.get_section(section)
+    for sentence_id in range(len(live.all_sentences)):
+        assert indexed.linked_sections(sentence_id) == live.linked_sections(sentence_id)
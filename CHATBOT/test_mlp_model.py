@@ -0,0 +1,80 @@
+"""
+Checks of the NumPy question classifier and its .h5 exporter.
+Run: python -m pytest test_mlp_model.py
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+from knowledge_base import KnowledgeBase
+from mlp_model import MLPModel, read_h5_layers, save_model
+from retrievers import MLPRetriever
+
+
+def write_keras_h5(path, layers):
+    """A Sequential model's .h5 file in the layout Keras saves (input layer, Dense layers, dropout)"""
+    h5py = pytest.importorskip('h5py')
+    config_layers = [{'class_name': 'InputLayer', 'config': {'name': 'input_layer'}}]
+    layer_names = []
+    with h5py.File(path, 'w') as f:
+        weights = f.create_group('model_weights')
+        for i, (kernel, bias, activation) in enumerate(layers):
+            name = 'dense' if i == 0 else f'dense_{i}'
+            config_layers.append({'class_name': 'Dense', 'config': {'name': name, 'activation': activation}})
+            layer_names.append(name)
+            group = weights.create_group(name)
+            group.create_dataset(f'sequential/{name}/kernel', data=kernel)
+            group.create_dataset(f'sequential/{name}/bias', data=bias)
+            group.attrs['weight_names'] = [f'sequential/{name}/kernel'.encode(), f'sequential/{name}/bias'.encode()]
+            if i == 0:
+                # Layers without weights are listed too
+                config_layers.append({'class_name': 'Dropout', 'config': {'name': 'dropout'}})
+                layer_names.append('dropout')
+                weights.create_group('dropout').attrs['weight_names'] = []
+        weights.attrs['layer_names'] = [name.encode() for name in layer_names]
+        f.attrs['model_config'] = json.dumps({'class_name': 'Sequential', 'config': {'layers': config_layers}})
+
+
+def test_read_h5_layers_returns_dense_layers_in_order(tmp_path):
+    rng = np.random.default_rng(0)
+    layers = [(rng.standard_normal((6, 4)).astype(np.float32), rng.standard_normal(4).astype(np.float32), 'relu'),
+              (rng.standard_normal((4, 3)).astype(np.float32), rng.standard_normal(3).astype(np.float32), 'softmax')]
+    path = tmp_path / "model.h5"
+    write_keras_h5(path, layers)
+
+    read = read_h5_layers(str(path))
+    assert [activation for _, _, activation in read] == ['relu', 'softmax']
+    for (kernel, bias, _), (expected_kernel, expected_bias, _) in zip(read, layers):
+        np.testing.assert_array_equal(kernel, expected_kernel)
+        np.testing.assert_array_equal(bias, expected_bias)
+
+
+KNOWLEDGE = """\
+[PRODUCTS]
+APS Naturals offers herbal skincare products for daily use.
+The products are suitable for sensitive skin.
+
+[RANGE]
+APS Naturals offers herbal skincare products for daily use too.
+"""
+
+
+def test_mlp_retriever_maps_answers_folded_into_a_near_duplicate(tmp_path):
+    knowledge_file = tmp_path / "kb.txt"
+    knowledge_file.write_text(KNOWLEDGE, encoding='utf-8')
+    kb = KnowledgeBase(str(knowledge_file), use_index=False, dedupe_threshold=0.8)
+    assert len(kb.all_sentences) == 2
+
+    # One-term model that always predicts the folded sentence
+    folded = "Yes, APS Naturals offers herbal skincare products for daily use too."
+    layers = [(np.ones((1, 2), dtype=np.float32), np.array([0.0, 5.0], dtype=np.float32), 'softmax')]
+    model_file = save_model(str(tmp_path / "model.npz"), layers, {'herbal': 0}, np.ones(1),
+                            ["The products are suitable for sensitive skin.", folded])
+    assert MLPModel(model_file).predict(["herbal"])[0][0] == folded
+
+    retriever = MLPRetriever(kb, model_file=model_file)
+    ids, scores = retriever.search("herbal")
+    assert kb.all_sentences[ids[0]] == "APS Naturals offers herbal skincare products for daily use."
+    assert scores[0] > 0.9
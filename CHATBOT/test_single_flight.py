@@ -0,0 +1,67 @@
+"""
+Checks of the single-flight answer pool. Run: python -m pytest test_single_flight.py
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from single_flight import BoundedExecutor, Overloaded, SingleFlight
+
+
+def test_do_async_shares_one_computation_without_blocking_the_loop():
+    flight = SingleFlight(BoundedExecutor(max_workers=1, max_pending=4))
+    release = threading.Event()
+    calls = []
+
+    def answer(question):
+        calls.append(question)
+        release.wait(5)
+        return question.upper()
+
+    async def main():
+        waiting = [asyncio.ensure_future(flight.do_async('q', answer, 'q')) for _ in range(3)]
+        # The loop keeps running other coroutines while answer() blocks its thread
+        ticks = 0
+        while flight.in_flight == 0 or ticks < 5:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert not any(task.done() for task in waiting)
+        release.set()
+        return await asyncio.gather(*waiting)
+
+    assert asyncio.run(main()) == ['Q', 'Q', 'Q']
+    assert calls == ['q']
+    assert flight.shared == 2
+
+
+def test_do_async_timeout_leaves_the_shared_computation_running():
+    flight = SingleFlight(BoundedExecutor(max_workers=1, max_pending=4))
+    release = threading.Event()
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await flight.do_async('q', lambda: release.wait(5) and 'done', timeout=0.05)
+        second = asyncio.ensure_future(flight.do_async('q', lambda: 'recomputed'))
+        await asyncio.sleep(0)
+        release.set()
+        return await second
+
+    # The second call joined the computation still in flight, not a new one
+    assert asyncio.run(main()) == 'done'
+
+
+def test_do_async_raises_overloaded():
+    flight = SingleFlight(BoundedExecutor(max_workers=1, max_pending=1))
+    release = threading.Event()
+
+    async def main():
+        first = asyncio.ensure_future(flight.do_async('a', release.wait, 5))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            await flight.do_async('b', lambda: None)
+        release.set()
+        await first
+
+    asyncio.run(main())
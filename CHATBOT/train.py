@@ -1,88 +1,430 @@
 """
-APS Naturals Chatbot - Setup and Verification Script
+APS Naturals Chatbot - Training Pipeline
 
-NOTE: This chatbot now uses a knowledge-based approach instead of neural network training.
-This script verifies that all required components are in place.
+Rebuilds the knowledge base indexes and retrains the question classifier
+(model.py) from Question:/Answer: pairs, e.g. as a nightly job:
+
+1. verify the knowledge base and rebuild the prebuilt TF-IDF and dense
+   indexes (kb_index.py, retrievers.py)
+2. load the question/answer pairs line by line (vectorizer.load_dataset)
+3. count the words and word n-grams of all questions once and cache the
+   counts on disk, keyed by the contents of the data
+4. grid search over vectorizer settings (max_features, n-gram range) and
+   hidden layer sizes in a process pool; every configuration picks its
+   vocabulary from the cached counts instead of re-tokenizing
+5. refit the best configuration on all pairs, export it to qa_model.npz
+   (see mlp_model.py) and write train_report.json with the build time,
+   model size, accuracy and query latency of every configuration
+
+Trains with TensorFlow/Keras (model.build_model) when it is installed and
+with scikit-learn's MLPClassifier (same layers) otherwise.
+
+Usage:
+    python train.py [qa_file] [--jobs N] [--out DIR]
+    python train.py --check        (only verify the knowledge base)
+
+Without qa_file the original training set (questions_original.pkl,
+answers.pkl) is used.
 """
 
+import argparse
+import hashlib
+import importlib.util
+import itertools
+import json
 import os
+import pickle
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+KNOWLEDGE_FILE = "dataset/apsnaturals_qa_dataset.txt"
+
+CACHE_FORMAT_VERSION = 1
+
+# Default search space; 0 max_features keeps every term
+GRID_MAX_FEATURES = [0, 1000, 300]
+GRID_NGRAMS = [1, 2]
+GRID_HIDDEN_SIZES = [(128, 64), (64, 32), (256, 128)]
+
+KERAS_EPOCHS = 200
+SKLEARN_MAX_ITER = 2000
+
+# Questions timed per configuration
+LATENCY_QUESTIONS = 200
 
-print("="*70)
-print("APS Naturals Chatbot - Knowledge-Based System Setup")
-print("="*70)
-
-# Check if dataset exists
-print("\n📂 Checking knowledge base file...")
-if not os.path.exists("dataset/apsnaturals_qa_dataset.txt"):
-    print("❌ Error: Knowledge base file not found!")
-    print("   Expected: dataset/apsnaturals_qa_dataset.txt")
-    sys.exit(1)
-
-print("✅ Knowledge base file found")
-
-# Verify knowledge base can be loaded
-print("\n🔍 Verifying knowledge base structure...")
-try:
-    from knowledge_base import get_knowledge_base
-    kb = get_knowledge_base()
-    print(f"✅ Knowledge base loaded successfully!")
-    print(f"   - {len(kb.all_sentences)} information pieces")
-    print(f"   - {len(kb.sections)} categories:")
-    for section in kb.sections.keys():
-        print(f"      • {section}")
-except Exception as e:
-    print(f"❌ Error loading knowledge base: {e}")
-    sys.exit(1)
-
-# Test the chatbot response system
-print("\n🧪 Testing chatbot response generation...")
-try:
-    test_questions = [
-        "What is APS Naturals?",
-        "Are your products organic?",
-        "Tell me about sustainability"
-    ]
-    
-    for question in test_questions:
-        answer, confidence = kb.generate_answer(question)
-        if answer:
-            print(f"✅ Test passed: '{question[:40]}...'")
+
+def verify_knowledge_base(knowledge_file=KNOWLEDGE_FILE):
+    """Check the knowledge base loads and answers; returns it, or None on failure"""
+    print("\n📂 Checking knowledge base file...")
+    if not os.path.exists(knowledge_file):
+        print("❌ Error: Knowledge base file not found!")
+        print(f"   Expected: {knowledge_file}")
+        return None
+    print("✅ Knowledge base file found")
+
+    print("\n🔍 Verifying knowledge base structure...")
+    try:
+        from knowledge_base import KnowledgeBase
+        kb = KnowledgeBase(knowledge_file)
+        print(f"✅ Knowledge base loaded successfully!")
+        print(f"   - {len(kb.all_sentences)} information pieces")
+        print(f"   - {len(kb.sections)} categories:")
+        for section in kb.sections.keys():
+            print(f"      • {section}")
+    except Exception as e:
+        print(f"❌ Error loading knowledge base: {e}")
+        return None
+
+    print("\n🧪 Testing chatbot response generation...")
+    try:
+        test_questions = [
+            "What is APS Naturals?",
+            "Are your products organic?",
+            "Tell me about sustainability"
+        ]
+
+        for question in test_questions:
+            answer, confidence = kb.generate_answer(question)
+            if answer:
+                print(f"✅ Test passed: '{question[:40]}...'")
+            else:
+                print(f"⚠️  Low confidence for: '{question}'")
+    except Exception as e:
+        print(f"❌ Error testing chatbot: {e}")
+        return None
+
+    print("\n📦 Checking dependencies...")
+    for module, package in [('flask', 'flask'), ('sklearn', 'scikit-learn'), ('nltk', 'nltk')]:
+        if importlib.util.find_spec(module):
+            print(f"✅ {package} installed")
         else:
-            print(f"⚠️  Low confidence for: '{question}'")
-            
-except Exception as e:
-    print(f"❌ Error testing chatbot: {e}")
-    sys.exit(1)
-
-# Check if required dependencies are installed
-print("\n📦 Checking dependencies...")
-try:
-    import flask
-    print("✅ Flask installed")
-except ImportError:
-    print("⚠️  Flask not installed. Install with: pip install flask")
-
-try:
-    import sklearn
-    print("✅ scikit-learn installed")
-except ImportError:
-    print("⚠️  scikit-learn not installed. Install with: pip install scikit-learn")
-
-try:
-    import nltk
-    print("✅ NLTK installed")
-except ImportError:
-    print("⚠️  NLTK not installed. Install with: pip install nltk")
-
-print("\n" + "="*70)
-print("✅ Setup verification completed!")
-print("="*70)
-print("\n📋 Next Steps:")
-print("   1. Run console chatbot: python chatbot.py")
-print("   2. Run web interface:   python app.py")
-print("   3. Then open browser:   http://localhost:5000")
-print("\n💡 Note: This chatbot uses knowledge-based retrieval.")
-print("   No training is needed - it dynamically generates answers!")
-print("="*70 + "\n")
+            print(f"⚠️  {package} not installed. Install with: pip install {package}")
+    return kb
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def _latency(search, questions):
+    """p50 / p99 milliseconds of search(question)"""
+    timings = []
+    for question in itertools.islice(itertools.cycle(questions), LATENCY_QUESTIONS):
+        start = time.perf_counter()
+        search(question)
+        timings.append(time.perf_counter() - start)
+    p50, p99 = np.percentile(timings, [50, 99]) * 1000
+    return round(float(p50), 3), round(float(p99), 3)
+
+
+def build_retrievers(kb, questions):
+    """Rebuild the on-disk retriever indexes; build time, size and latency of each"""
+    import kb_index
+    from retrievers import BM25Retriever, DenseRetriever, default_dense_index_dir
+
+    report = []
+
+    start = time.perf_counter()
+    index_dir = kb_index.save_index(kb)
+    build_seconds = time.perf_counter() - start
+    p50, p99 = _latency(lambda q: kb.search(q, top_k=5), questions)
+    report.append({'retriever': 'tfidf', 'build_seconds': round(build_seconds, 3),
+                   'index_bytes': _directory_size(index_dir), 'query_ms_p50': p50, 'query_ms_p99': p99})
+
+    start = time.perf_counter()
+    bm25 = BM25Retriever(kb)
+    build_seconds = time.perf_counter() - start
+    p50, p99 = _latency(lambda q: bm25.search(q, 5), questions)
+    report.append({'retriever': 'bm25', 'build_seconds': round(build_seconds, 3),
+                   'index_bytes': None, 'query_ms_p50': p50, 'query_ms_p99': p99})
+
+    start = time.perf_counter()
+    dense = DenseRetriever(kb, use_index=False)
+    dense.save()
+    build_seconds = time.perf_counter() - start
+    p50, p99 = _latency(lambda q: dense.search(q, 5), questions)
+    report.append({'retriever': 'dense', 'build_seconds': round(build_seconds, 3),
+                   'index_bytes': _directory_size(default_dense_index_dir(kb.knowledge_file)),
+                   'query_ms_p50': p50, 'query_ms_p99': p99})
+    return report
+
+
+def load_pairs(qa_file=None):
+    """(questions, answers) from a Question:/Answer: file, or the original training set"""
+    if qa_file:
+        from vectorizer import load_dataset
+        return load_dataset(qa_file)
+
+    with open("questions_original.pkl", 'rb') as f:
+        questions = pickle.load(f)
+    with open("answers.pkl", 'rb') as f:
+        answers = pickle.load(f)
+    return questions, answers
+
+
+def cache_features(questions, answers, ngram_max, cache_dir):
+    """
+    Count every word and word n-gram (up to ngram_max words) of the questions
+    once and store the counts with the labels; reused while the data is unchanged
+    """
+    digest = hashlib.sha256(json.dumps([CACHE_FORMAT_VERSION, ngram_max, questions, answers]).encode('utf-8'))
+    cache_file = os.path.join(cache_dir, f"features-{digest.hexdigest()[:16]}.npz")
+    if os.path.exists(cache_file):
+        return cache_file, True
+
+    from sklearn.feature_extraction.text import CountVectorizer
+    counter = CountVectorizer(ngram_range=(1, ngram_max))
+    counts = counter.fit_transform(questions).tocsr()
+
+    # One class per distinct answer, in order of first appearance
+    classes = {}
+    labels = np.array([classes.setdefault(answer, len(classes)) for answer in answers])
+
+    os.makedirs(cache_dir, exist_ok=True)
+    np.savez(cache_file, data=counts.data, indices=counts.indices, indptr=counts.indptr,
+             shape=np.array(counts.shape), terms=np.array(counter.get_feature_names_out(), dtype=str),
+             labels=labels, answers=np.array(list(classes), dtype=str), questions=np.array(questions, dtype=str))
+    return cache_file, False
+
+
+def split_rows(labels):
+    """
+    Training and evaluation rows: the last question of every answer that has
+    several is held out. If no answer has several, evaluate on the training rows
+    """
+    last = {}
+    for row, label in enumerate(labels):
+        last.setdefault(label, []).append(row)
+    held_out = sorted(rows[-1] for rows in last.values() if len(rows) > 1)
+    if not held_out:
+        rows = np.arange(len(labels))
+        return rows, rows
+    return np.setdiff1d(np.arange(len(labels)), held_out), np.array(held_out)
+
+
+class Features:
+    """Cached question counts, from which every configuration takes its vectors"""
+
+    def __init__(self, cache_file):
+        from scipy.sparse import csr_matrix
+        with np.load(cache_file, allow_pickle=False) as arrays:
+            self.counts = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                     shape=tuple(arrays['shape']))
+            self.terms = [str(term) for term in arrays['terms']]
+            self.labels = arrays['labels']
+            self.answers = [str(answer) for answer in arrays['answers']]
+            self.questions = [str(question) for question in arrays['questions']]
+        self.term_words = np.array([term.count(' ') + 1 for term in self.terms])
+
+    def vectorize(self, max_features, ngram_max, rows):
+        """
+        Fit the vocabulary and IDF on `rows` exactly as
+        TfidfVectorizer(max_features=..., ngram_range=(1, ngram_max)) would
+        Returns (vocabulary, idf, TF-IDF vectors of all questions)
+        """
+        from sklearn.feature_extraction.text import TfidfTransformer
+        from kb_stream import _select_vocabulary
+
+        fit_counts = self.counts[rows]
+        totals = np.asarray(fit_counts.sum(axis=0)).ravel()
+        eligible = np.flatnonzero((self.term_words <= ngram_max) & (totals > 0))
+        vocabulary = _select_vocabulary({self.terms[i]: totals[i] for i in eligible}, max_features or None)
+
+        columns = np.empty(len(vocabulary), dtype=np.intp)
+        positions = {term: i for i, term in enumerate(self.terms)}
+        for term, column in vocabulary.items():
+            columns[column] = positions[term]
+        weighting = TfidfTransformer().fit(fit_counts[:, columns])
+        return vocabulary, weighting.idf_, weighting.transform(self.counts[:, columns])
+
+
+def fit_layers(x, y, n_classes, hidden_sizes, backend, seed=0):
+    """Train the classifier; returns its [(kernel, bias, activation), ...]"""
+    if backend == 'keras':
+        import tensorflow as tf
+        from model import build_model
+        tf.keras.utils.set_random_seed(seed)
+        model = build_model(x.shape[1], n_classes, hidden_sizes)
+        model.fit(x.toarray(), y, epochs=KERAS_EPOCHS, verbose=0)
+        return [(*layer.get_weights(), layer.get_config()['activation']) for layer in model.layers]
+
+    from sklearn.neural_network import MLPClassifier
+    classifier = MLPClassifier(hidden_sizes, activation='relu', max_iter=SKLEARN_MAX_ITER,
+                               random_state=seed).fit(x, y)
+    layers = [(kernel, bias, 'relu') for kernel, bias in
+              zip(classifier.coefs_[:-1], classifier.intercepts_[:-1])]
+
+    # Output layer over all n_classes: classes missing from y never win
+    kernel, bias = classifier.coefs_[-1], classifier.intercepts_[-1]
+    if classifier.out_activation_ == 'logistic':
+        # Two classes: sigmoid(z) == softmax([0, z])[1]
+        kernel = np.hstack([np.zeros_like(kernel), kernel])
+        bias = np.concatenate([[0.0], bias])
+    out_kernel = np.zeros((kernel.shape[0], n_classes))
+    out_bias = np.full(n_classes, -1e9)
+    out_kernel[:, classifier.classes_] = kernel
+    out_bias[classifier.classes_] = bias
+    layers.append((out_kernel, out_bias, 'softmax'))
+    return layers
+
+
+def config_name(config):
+    return "mf{}-ng{}-h{}".format(config['max_features'] or 'all', config['ngram_max'],
+                                  'x'.join(map(str, config['hidden_sizes'])))
+
+
+# Features shared by the configurations a worker process trains
+_features = None
+
+
+def _load_features(cache_file):
+    global _features
+    _features = Features(cache_file)
+
+
+def train_config(config, backend, model_file, final=False):
+    """Train one configuration and measure it; final=True trains on every question"""
+    from mlp_model import MLPModel, save_model
+
+    features = _features
+    train_rows, eval_rows = split_rows(features.labels)
+    if final:
+        train_rows = eval_rows = np.arange(len(features.labels))
+
+    start = time.perf_counter()
+    vocabulary, idf, vectors = features.vectorize(config['max_features'], config['ngram_max'], train_rows)
+    layers = fit_layers(vectors[train_rows], features.labels[train_rows], len(features.answers),
+                        config['hidden_sizes'], backend)
+    save_model(model_file, layers, vocabulary, idf, features.answers, (1, config['ngram_max']))
+    build_seconds = time.perf_counter() - start
+
+    model = MLPModel(model_file)
+    predicted = model.predict_proba(model.vectorize([features.questions[i] for i in eval_rows])).argmax(axis=1)
+    accuracy = float(np.mean(predicted == features.labels[eval_rows]))
+    # Without held-out questions (see split_rows) this is training accuracy
+    held_out = len(np.intersect1d(train_rows, eval_rows)) == 0
+
+    p50, p99 = _latency(lambda q: model.predict([q]), features.questions)
+    batch = list(itertools.islice(itertools.cycle(features.questions), LATENCY_QUESTIONS))
+    start = time.perf_counter()
+    model.predict(batch)
+    batch_us = (time.perf_counter() - start) / len(batch) * 1e6
+
+    return {
+        'config': config_name(config), **config, 'hidden_sizes': list(config['hidden_sizes']),
+        'terms': len(vocabulary), 'accuracy': round(accuracy, 4),
+        'accuracy_on': 'held_out' if held_out else 'training', 'evaluated_questions': len(eval_rows),
+        'build_seconds': round(build_seconds, 3), 'model_bytes': os.path.getsize(model_file),
+        'query_ms_p50': p50, 'query_ms_p99': p99, 'batch_us_per_query': round(batch_us, 1)
+    }
+
+
+def grid_search(cache_file, configs, backend, jobs, candidates_dir):
+    """Train and measure every configuration in a pool of worker processes"""
+    os.makedirs(candidates_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_load_features,
+                             initargs=(cache_file,)) as pool:
+        futures = [pool.submit(train_config, config, backend,
+                               os.path.join(candidates_dir, config_name(config) + '.npz'))
+                   for config in configs]
+        return [future.result() for future in futures]
+
+
+def _hidden_sizes(text):
+    return tuple(int(size) for size in text.split(','))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the retriever indexes and train the question classifier")
+    parser.add_argument('qa_file', nargs='?', help="Question:/Answer: file (default: the original training set)")
+    parser.add_argument('--knowledge-file', default=KNOWLEDGE_FILE)
+    parser.add_argument('--max-features', type=int, nargs='+', default=GRID_MAX_FEATURES,
+                        help="vocabulary sizes to try (0: every term)")
+    parser.add_argument('--ngrams', type=int, nargs='+', default=GRID_NGRAMS,
+                        help="longest word n-grams to try")
+    parser.add_argument('--hidden', type=_hidden_sizes, nargs='+', default=GRID_HIDDEN_SIZES,
+                        help="hidden layer sizes to try, e.g. 128,64")
+    parser.add_argument('--backend', choices=['auto', 'keras', 'sklearn'], default='auto')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--cache-dir', default=".train_cache")
+    parser.add_argument('--out', default=".", help="directory for qa_model.npz and train_report.json")
+    parser.add_argument('--check', action='store_true', help="only verify the knowledge base")
+    args = parser.parse_args(argv)
+
+    print("=" * 70)
+    print("APS Naturals Chatbot - Training Pipeline")
+    print("=" * 70)
+
+    kb = verify_knowledge_base(args.knowledge_file)
+    if kb is None:
+        return 1
+    if args.check:
+        print("\n✅ Setup verification completed!")
+        return 0
+
+    if args.qa_file and not os.path.exists(args.qa_file):
+        print(f"❌ Training data not found: {args.qa_file}")
+        return 1
+    questions, answers = load_pairs(args.qa_file)
+    if not questions:
+        print("❌ No Question:/Answer: pairs found")
+        return 1
+    print(f"\n📚 Loaded {len(questions)} questions, {len(set(answers))} answers")
+
+    print("\n🗂️  Rebuilding retriever indexes...")
+    retrievers = build_retrievers(kb, questions)
+    for row in retrievers:
+        print(f"✅ {row['retriever']:<6} built in {row['build_seconds']:.2f}s, "
+              f"p50 {row['query_ms_p50']:.2f} ms")
+
+    cache_file, cached = cache_features(questions, answers, max(args.ngrams), args.cache_dir)
+    print(f"\n🧮 Question features {'reused from' if cached else 'cached in'} {cache_file}")
+
+    backend = args.backend
+    if backend == 'auto':
+        backend = 'keras' if importlib.util.find_spec('tensorflow') else 'sklearn'
+    configs = [{'max_features': max_features, 'ngram_max': ngram_max, 'hidden_sizes': hidden_sizes}
+               for max_features, ngram_max, hidden_sizes
+               in itertools.product(args.max_features, args.ngrams, args.hidden)]
+    print(f"\n🔬 Training {len(configs)} configurations ({backend}, {args.jobs} processes)...")
+    start = time.perf_counter()
+    results = grid_search(cache_file, configs, backend, args.jobs, os.path.join(args.cache_dir, 'candidates'))
+    print(f"   done in {time.perf_counter() - start:.1f}s\n")
+
+    print(f"   {'configuration':<22}{'terms':>6}{'accuracy':>10}{'build s':>9}{'KiB':>8}{'p50 ms':>8}{'p99 ms':>8}")
+    for row in results:
+        print(f"   {row['config']:<22}{row['terms']:>6}{row['accuracy']:>10.3f}{row['build_seconds']:>9.2f}"
+              f"{row['model_bytes'] / 1024:>8.1f}{row['query_ms_p50']:>8.3f}{row['query_ms_p99']:>8.3f}")
+
+    # Most accurate, then fastest
+    best = min(results, key=lambda row: (-row['accuracy'], row['query_ms_p50']))
+    best_config = next(config for config in configs if config_name(config) == best['config'])
+    print(f"\n🏆 Best configuration: {best['config']} (accuracy {best['accuracy']:.3f})")
+    if best['accuracy_on'] == 'training':
+        print("⚠️  No answer has several questions, so none could be held out: accuracy is")
+        print("   measured on the training questions and says little about new questions")
+
+    os.makedirs(args.out, exist_ok=True)
+    model_file = os.path.join(args.out, "qa_model.npz")
+    _load_features(cache_file)
+    final = train_config(best_config, backend, model_file, final=True)
+
+    report_file = os.path.join(args.out, "train_report.json")
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump({'data': args.qa_file or "questions_original.pkl", 'backend': backend,
+                   'questions': len(questions), 'answers': len(set(answers)),
+                   'retrievers': retrievers, 'configurations': results, 'best': best['config'],
+                   'accuracy_on': best['accuracy_on'],
+                   'final_model': final}, f, indent=2)
+
+    print(f"✅ Model written to {model_file} ({final['model_bytes'] / 1024:.1f} KiB)")
+    print(f"✅ Report written to {report_file}")
+    print("\n💡 Serve the model with: KB_RETRIEVER=mlp python app.py")
+    return 0
+
 
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,38 +1,30 @@
 from sklearn.feature_extraction.text import TfidfVectorizer
-from preprocessing import clean_text
+from preprocessing import get_normalizer
 
 def load_dataset(file_path):
     questions = []
     answers = []
 
+    # Read line by line instead of loading the whole file
     with open(file_path, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # Skip empty lines
-        if not line:
-            i += 1
-            continue
-        
-        # Process question
-        if line.startswith("Question:"):
+        lines = (line.strip() for line in file)
+        for line in lines:
+            # Skip everything but questions (empty lines included)
+            if not line.startswith("Question:"):
+                continue
+            
+            # Process question
             q = line.replace("Question:", "").strip()
-            i += 1
             
-            # Get the answer from next non-empty line
-            if i < len(lines) and lines[i].strip().startswith("Answer:"):
-                a = lines[i].replace("Answer:", "").strip()
-                questions.append(clean_text(q))
+            # Get the answer from the next line
+            next_line = next(lines, "")
+            if next_line.startswith("Answer:"):
+                a = next_line.replace("Answer:", "").strip()
+                questions.append(q)
                 answers.append(a)
-                i += 1
-            else:
-                i += 1
-        else:
-            i += 1
 
+    # Clean all questions in one pass
+    questions = list(get_normalizer().clean_many(questions))
     return questions, answers
 
 def vectorize_data(questions):
@@ -0,0 +1,29 @@
+"""
+APS Naturals Chatbot - Production WSGI Entry Point
+Loads the knowledge base at import time, so a pre-forking server that imports
+this module in its master process (gunicorn --preload, see gunicorn.conf.py)
+builds it once and every forked worker shares those pages copy-on-write.
+
+Usage:
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import gc
+
+from app import app, load_knowledge_base
+
+# The watcher thread would not survive fork(); workers start their own
+kb = load_knowledge_base(watch=False)
+
+# Precomputing the answer table searched a sharded knowledge base, which
+# started its shard worker processes here; stop them so they are neither
+# inherited by the workers nor left idle in the master (each worker starts
+# its own on its first search)
+if hasattr(kb, 'close'):
+    kb.close()
+
+# Move everything allocated so far out of the garbage collector's reach:
+# collections in the workers would otherwise write to these objects' headers
+# and turn the shared pages into private copies
+gc.collect()
+gc.freeze()